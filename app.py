@@ -1,84 +1,214 @@
-from cs50 import SQL
+from datetime import timedelta
+import click
 from flask import Flask, render_template
-from flask_session import Session
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from flask_login import LoginManager
 
 from decouple import config
 
-from index import home_bp 
+from index import home_bp
 from auth import auth_bp
 from builder import builder_bp
 from respond import respond_bp
-from models import db,User
+from models import db
+from schema_cache import form_schema_cache
+from migrations import upgrade as upgrade_schema, check_query_plans
+from database import configure_engine, register_pragmas
+from ingest import submission_queue
+from submissions import group_commit_writer
+from sessions import init_sessions
+from duplicates import duplicate_guard
+from caching import apply_cache_policy, init_caching
+from fragments import precompile_templates, respond_fragments
+from metrics import request_metrics
+from user_cache import load_identity, user_cache
+from passwords import password_hasher
 
-app = Flask(__name__)
+# Extensions are created here and bound to an app in create_app()
+csrf = CSRFProtect()
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+login_manager.login_message = 'Please log in to access this page.'
+login_manager.login_message_category = 'info'
 
 
-# Configure session to use filesystem (instead of signed cookies)
-app.config.from_mapping(
-    SECRET_KEY='SECRET_KEY',
-    SESSION_PERMANENT=False,
-    SESSION_TYPE='filesystem',
-    WTF_CSRF_ENABLED=True,
-    WTF_CSRF_TIME_LIMIT=None
-)
+def load_config(app):
+    # Sessions live in a small SQLite file by default (see sessions.py)
+    app.config.from_mapping(
+        SECRET_KEY=config('SECRET_KEY', default='SECRET_KEY'),
+        SESSION_PERMANENT=False,
+        SESSION_BACKEND=config('SESSION_BACKEND', default='sqlite'),
+        SESSION_DB_PATH=config('SESSION_DB_PATH', default=''),
+        PERMANENT_SESSION_LIFETIME=timedelta(days=config('SESSION_LIFETIME_DAYS', default=30, cast=int)),
+        RESPONDED_FORMS_LIMIT=config('RESPONDED_FORMS_LIMIT', default=50, cast=int),
+        WTF_CSRF_ENABLED=True,
+        WTF_CSRF_TIME_LIMIT=None
+    )
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///project.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-# app.config["SESSION_PERMANENT"] = False
-# app.config["SESSION_TYPE"] = "filesystem"
-# app.config["SECRET_KEY"] = "your_secret_key_change_this_in_production"  # Make sure this is set
-# app.config['WTF_CSRF_ENABLED'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = config('DATABASE_URL', default='sqlite:///project.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['FORM_SCHEMA_CACHE_SIZE'] = config('FORM_SCHEMA_CACHE_SIZE', default=512, cast=int)
+    app.config['FORM_SCHEMA_CACHE_TTL'] = config('FORM_SCHEMA_CACHE_TTL', default=30, cast=int)
+    app.config['SUBMISSION_QUEUE_ENABLED'] = config('SUBMISSION_QUEUE_ENABLED', default=False, cast=bool)
+    app.config['SUBMISSION_QUEUE_PATH'] = config('SUBMISSION_QUEUE_PATH', default='')
+    app.config['SUBMISSION_QUEUE_BATCH_SIZE'] = config('SUBMISSION_QUEUE_BATCH_SIZE', default=500, cast=int)
+    app.config['GROUP_COMMIT_ENABLED'] = config('GROUP_COMMIT_ENABLED', default=False, cast=bool)
+    app.config['GROUP_COMMIT_WINDOW_MS'] = config('GROUP_COMMIT_WINDOW_MS', default=5, cast=float)
+    app.config['GROUP_COMMIT_MAX_BATCH'] = config('GROUP_COMMIT_MAX_BATCH', default=200, cast=int)
+    app.config['DUPLICATE_POLICY'] = config('DUPLICATE_POLICY', default='browser')
+    app.config['DUPLICATE_CACHE_SIZE'] = config('DUPLICATE_CACHE_SIZE', default=100000, cast=int)
+    app.config['RESPOND_FRAGMENT_CACHE_SIZE'] = config('RESPOND_FRAGMENT_CACHE_SIZE', default=512, cast=int)
+    app.config['PRECOMPILE_TEMPLATES'] = config('PRECOMPILE_TEMPLATES', default=True, cast=bool)
+    app.config['METRICS_TOKEN'] = config('METRICS_TOKEN', default='')
+    # /metrics reveals per-endpoint traffic and timings, so it is off unless a token protects it
+    app.config['METRICS_ENABLED'] = config('METRICS_ENABLED', default=bool(app.config['METRICS_TOKEN']), cast=bool)
+    app.config['METRICS_QUERY_WARN_THRESHOLD'] = config('METRICS_QUERY_WARN_THRESHOLD', default=20, cast=int)
+    app.config['USER_CACHE_SIZE'] = config('USER_CACHE_SIZE', default=4096, cast=int)
+    app.config['USER_CACHE_TTL'] = config('USER_CACHE_TTL', default=60, cast=int)
+    app.config['PASSWORD_HASH_WORKERS'] = config('PASSWORD_HASH_WORKERS', default=2, cast=int)
+    app.config['PASSWORD_HASH_MAX_PENDING'] = config('PASSWORD_HASH_MAX_PENDING', default=32, cast=int)
 
-# Initialize extensions
-Session(app)
-csrf = CSRFProtect(app)
 
-# Initialize Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'auth.login'
-login_manager.login_message = 'Please log in to access this page.'
-login_manager.login_message_category = 'info'
+def create_app(overrides=None):
+    """Build the application without touching the database.
+
+    Nothing here connects to the database or creates tables; run
+    `flask db-upgrade` to create or migrate the schema. `overrides` is
+    applied on top of the decouple settings (tests, benchmarks).
+    """
+    app = Flask(__name__)
+    load_config(app)
+    if overrides:
+        app.config.update(overrides)
+
+    # Initialize extensions
+    init_sessions(app)
+    csrf.init_app(app)
+    form_schema_cache.init_app(app)
+    duplicate_guard.init_app(app)
+    init_caching(app)
+    respond_fragments.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+    login_manager.init_app(app)
+
+    # Register blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(home_bp, url_prefix='/')
+    app.register_blueprint(builder_bp)
+    app.register_blueprint(respond_bp)
+
+    configure_engine(app)
+    db.init_app(app)
+    register_pragmas(app, db)  # WAL, busy_timeout, foreign_keys... on every pooled connection
+    request_metrics.init_app(app, db)  # Query counts and timings per endpoint, served on /metrics
+
+    submission_queue.init_app(app)
+    group_commit_writer.init_app(app)
+
+    app.after_request(after_request)
+    app.context_processor(inject_csrf_token)
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, internal_error)
+    register_commands(app)
+
+    if app.config['PRECOMPILE_TEMPLATES']:
+        precompile_templates(app)  # No Jinja compile on the first request to each page
+    return app
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(str(user_id)) 
+    # Cached id/username identity; a query only on a cache miss
+    return load_identity(user_id)
+
+
+def register_commands(app):
+    @app.cli.command("db-upgrade")
+    def db_upgrade():
+        """Create the database schema, or apply pending migrations to an existing one"""
+        applied = upgrade_schema()
+        for number, description in applied:
+            print(f"Applied migration {number}: {description}")
+        if not applied:
+            print("Database schema is up to date")
 
-# Register blueprints
-app.register_blueprint(auth_bp) 
-app.register_blueprint(home_bp, url_prefix='/') 
-app.register_blueprint(builder_bp)
-app.register_blueprint(respond_bp)
+    @app.cli.command("check-query-plans")
+    def check_query_plans_command():
+        """Fail if a hot query would scan a whole table instead of using an index"""
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"{name}: {detail}")
+        if problems:
+            raise SystemExit(1)
+        print("All hot queries use an index")
 
+    @app.cli.command("sweep-empty-forms")
+    @click.option("--older-than", default=24 * 60, show_default=True, help="Minimum age in minutes")
+    @click.option("--batch-size", default=200, show_default=True, help="Forms deleted per transaction")
+    def sweep_empty_forms_command(older_than, batch_size):
+        """Delete unfinished forms (no name, title or questions); meant to run from cron"""
+        from maintenance import sweep_empty_forms
+        deleted = sweep_empty_forms(timedelta(minutes=older_than), batch_size)
+        print(f"Deleted {deleted} empty forms")
 
+    @app.cli.command("purge-sessions")
+    def purge_sessions():
+        """Delete expired sessions from the SQLite session store"""
+        if not hasattr(app.session_interface, "purge_expired"):
+            print(f"Sessions are not stored in SQLite (SESSION_BACKEND={app.config['SESSION_BACKEND']})")
+            return
+        print(f"Deleted {app.session_interface.purge_expired()} expired sessions")
 
-db.init_app(app) 
+    @app.cli.command("drain-submissions")
+    def drain_submissions():
+        """Write every queued submission to the database now"""
+        if not submission_queue.enabled:
+            print("The submission queue is disabled (SUBMISSION_QUEUE_ENABLED)")
+            return
+        print(f"Wrote {submission_queue.drain()} queued submissions")
+
+    @app.cli.command("failed-submissions")
+    @click.option("--retry", is_flag=True, help="Queue them again with a fresh set of attempts")
+    def failed_submissions(retry):
+        """List queued submissions that kept failing and are no longer retried"""
+        if not submission_queue.enabled:
+            print("The submission queue is disabled (SUBMISSION_QUEUE_ENABLED)")
+            return
+        failed = submission_queue.failed()
+        for row_id, item in failed:
+            print(f"{row_id}: form {item['form_id']}, responder {item['responder_id']}, queued {item['created_at']}")
+        if retry:
+            print(f"Queued {submission_queue.retry_failed()} failed submissions again")
+        elif not failed:
+            print("No failed submissions")
+
+    @app.cli.command("backfill-selections")
+    def backfill_selections():
+        """Fill answer_selections from responses saved before the table existed"""
+        from stats import backfill_answer_selections, rebuild_option_counts
+        upgrade_schema()
+        print(f"Backfilled {backfill_answer_selections()} answer selections")
+        print(f"Rebuilt {rebuild_option_counts()} option counters")
+
+    @app.cli.command("rebuild-counts")
+    @click.option("--form-id", default=None, help="Only rebuild the counters of this form")
+    def rebuild_counts(form_id):
+        """Recompute the per-option counters from answer_selections"""
+        from stats import rebuild_option_counts
+        upgrade_schema()
+        print(f"Rebuilt {rebuild_option_counts(form_id)} option counters")
 
-with app.app_context():
-    db.create_all()
-    db.session.execute(text("PRAGMA foreign_keys = ON;"))  # Wrap with text()
-    db.session.commit()
 
-@app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
+    """Cache hashed static files for good, revalidate form pages, store nothing else"""
+    return apply_cache_policy(response)
 
 # Add CSRF token to all templates
-@app.context_processor
 def inject_csrf_token():
-    from flask_wtf.csrf import generate_csrf
     return dict(csrf_token=generate_csrf)
 
 # Error handlers
-@app.errorhandler(404)
 def not_found(error):
     try:
         return render_template('404.html'), 404
@@ -95,7 +225,6 @@ def not_found(error):
         </html>
         ''', 404
 
-@app.errorhandler(500)
 def internal_error(error):
     try:
         return render_template('500.html'), 500
@@ -113,8 +242,21 @@ def internal_error(error):
         ''', 500
 
 
+def __getattr__(name):
+    # `from app import app` and `flask --app app ...` still work; the app is only built on first use
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 ''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        upgrade_schema()  # The development server creates the schema itself; elsewhere run `flask db-upgrade`
     # app.run(debug=True)
-    app.run(host=config('HOST'), port=config('PORT'))
\ No newline at end of file
+    # Development server only; production runs `python serve.py`
+    app.run(host=config('HOST'), port=config('PORT'))
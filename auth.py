@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, request, session, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from models import User, db
+from models import User, db, new_id
 from forms import LoginForm, RegisterForm, ChangePasswordForm
-from werkzeug.security import generate_password_hash
+from passwords import password_hasher, PasswordHasherBusy
+from user_cache import user_cache
 
 
 auth_bp = Blueprint('auth', __name__)
@@ -17,14 +18,13 @@ def register():
                 flash('Username already exists.', 'danger')
                 return redirect(url_for('auth.register'))
             
-            # Generate unique ID for new user
-            from models import generate_random_id
-            user_id = generate_random_id()
-            while User.query.get(user_id):  # Ensure uniqueness
-                user_id = generate_random_id()
-                
-            user = User(id=user_id, username=form.username.data)
-            user.set_password(form.password.data)
+            # Time-ordered ID, unique without checking the table
+            try:
+                password = password_hasher.hash(form.password.data)
+            except PasswordHasherBusy:
+                flash('The server is busy, please try again in a moment.', 'danger')
+                return render_template("register.html", form=form), 503
+            user = User(id=new_id("users"), username=form.username.data, password=password)
             db.session.add(user)
             db.session.commit()
             login_user(user)
@@ -42,7 +42,13 @@ def login():
     if request.method == "POST":
         if form.validate_on_submit():
             user = User.query.filter_by(username=form.username.data).first()
-            if user and user.check_password(form.password.data):
+            try:
+                # Hashing runs on a small bounded pool so login bursts can't tie up every request thread
+                valid = user is not None and password_hasher.check(user.password, form.password.data)
+            except PasswordHasherBusy:
+                flash('The server is busy, please try again in a moment.', 'error')
+                return render_template("login.html", form=form), 503
+            if valid:
                 login_user(user)
                 flash('Login successful!', 'success')
                 return redirect('/')
@@ -72,12 +78,19 @@ def change_password():
         return render_template('change_password.html', form=form)
     
     if form.validate_on_submit():
-        if current_user.check_password(form.current_password.data): 
-            current_user.password_hash = generate_password_hash(form.new_password.data)
-            db.session.commit()
-            flash('Password changed successfully!', 'success')
-            return redirect('/') 
-        else:
-            flash('Current password is incorrect', 'error')
+        # current_user is a cached identity; the password lives on the full row
+        user = User.query.get(current_user.id)
+        try:
+            if password_hasher.check(user.password, form.current_password.data):
+                user.password = password_hasher.hash(form.new_password.data)
+                db.session.commit()
+                user_cache.invalidate(user.id)
+                flash('Password changed successfully!', 'success')
+                return redirect('/') 
+            else:
+                flash('Current password is incorrect', 'error')
+        except PasswordHasherBusy:
+            flash('The server is busy, please try again in a moment.', 'error')
+            return render_template('change_password.html', form=form), 503
     
     return render_template('change_password.html', form=form)
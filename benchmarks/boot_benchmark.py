@@ -0,0 +1,65 @@
+"""Measure how long a fresh process takes to import the app and build it.
+
+Each run is a new interpreter, as for a newly spawned worker. Fails if the
+median boot time is over --target-ms, or if building the app touched the
+database file:
+
+    python benchmarks/boot_benchmark.py --runs 10 --target-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+built = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_ms": (built - imported) * 1000}))
+"""
+
+
+def boot_once(env):
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True,
+                            text=True, check=True).stdout.strip().splitlines()[-1]
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target-ms", type=float, default=800, help="Maximum median import + create_app time")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="forms-boot-")
+    database = os.path.join(workdir, "boot.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", SESSION_DB_PATH=os.path.join(workdir, "sessions.db"))
+
+    runs = [boot_once(env) for _ in range(args.runs)]
+    imports = [run["import_ms"] for run in runs]
+    creates = [run["create_ms"] for run in runs]
+    totals = [run["import_ms"] + run["create_ms"] for run in runs]
+    print(f"import app:   median {statistics.median(imports):.0f} ms, max {max(imports):.0f} ms")
+    print(f"create_app(): median {statistics.median(creates):.0f} ms, max {max(creates):.0f} ms")
+    print(f"total:        median {statistics.median(totals):.0f} ms (target {args.target_ms:.0f} ms)")
+
+    failed = False
+    if os.path.exists(database):
+        print("Building the app created the database file; startup must not touch the database")
+        failed = True
+    if statistics.median(totals) > args.target_ms:
+        print("Boot time is over the target")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Load-test concurrent submissions with and without group commit.
+
+Many threads post to /respond/<form_id> at once, first with one transaction
+per submission and then through the group-commit writer:
+
+    python benchmarks/group_commit_benchmark.py --threads 32 --submissions 2000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from submit_benchmark import load_app, seed_form
+
+
+def run(app, form_id, payload, threads, submissions):
+    per_thread = submissions // threads
+    failures = []
+
+    def worker():
+        client = app.test_client()
+        for _ in range(per_thread):
+            # Each submission comes from a fresh respondent
+            with client.session_transaction() as session:
+                session.clear()
+            client.delete_cookie("respondent")
+            response = client.post(f"/respond/{form_id}", data=payload)
+            if response.status_code != 302:
+                failures.append(response.status_code)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads, elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--submissions", type=int, default=2000)
+    parser.add_argument("--synchronous", default=None,
+                        help="Override PRAGMA synchronous (e.g. FULL to count every fsync)")
+    args = parser.parse_args()
+
+    if args.synchronous:
+        os.environ["SQLITE_SYNCHRONOUS"] = args.synchronous
+
+    app = load_app(tempfile.mkdtemp(prefix="forms-bench-"))
+    form_id, payload = seed_form(app, args.questions, args.options)
+    app.test_client().post(f"/respond/{form_id}", data=payload)
+
+    from submissions import group_commit_writer
+    for enabled in (False, True):
+        group_commit_writer.enabled = enabled
+        count, elapsed, failures = run(app, form_id, payload, args.threads, args.submissions)
+        label = "group commit" if enabled else "per-request commit"
+        print(f"{label:>20}: {count} submissions from {args.threads} threads in {elapsed:.2f}s "
+              f"-> {count / elapsed:.1f} submissions/sec ({len(failures)} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Fill a database with synthetic users, forms and responses for benchmarking.
+
+Rows go in with bulk executemany inserts, a chunk at a time inside one
+transaction per form, at tens of thousands of responses per second:
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed_data.py --responses 50000
+"""
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import time
+
+from sqlalchemy import insert
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+ANSWER_TYPES = ["text", "radio", "checkbox", "dropdown"]
+CHUNK_SIZE = 10000
+OWNER_PASSWORD = "benchmark"
+
+
+def _insert_chunked(conn, table, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        conn.execute(insert(table), rows[start:start + CHUNK_SIZE])
+
+
+def seed_form_rows(conn, user_id, questions, options, responses, rng, name="bench"):
+    """Insert one form with its questions, options and `responses` responders; returns the form id"""
+    from models import Form, Question, Option, Responder, Response, AnswerSelection, OptionCount, new_id
+
+    now = datetime.now()
+    form_id = new_id("forms")
+    conn.execute(Form.__table__.insert(), [{
+        'id': form_id, 'name': name, 'title': f"{name} title", 'description': "Synthetic form",
+        'questionCount': questions, 'responsesCount': responses, 'version': 1,
+        'createdAt': now.strftime("%Y-%m-%d %H:%M:%S"), 'userId': user_id
+    }])
+
+    question_rows, option_rows, choices = [], [], []
+    for i in range(questions):
+        question_id = new_id("questions")
+        answer_type = ANSWER_TYPES[i % len(ANSWER_TYPES)]
+        question_rows.append({
+            'id': question_id, 'text': f"Question {i}", 'answerType': answer_type,
+            'optionCount': 0 if answer_type == "text" else options, 'formId': form_id, 'saved': True
+        })
+        question_options = []
+        if answer_type != "text":
+            for j in range(options):
+                option_id = new_id("options")
+                option_rows.append({'id': option_id, 'text': f"Option {j}", 'questionId': question_id, 'formId': form_id})
+                question_options.append((option_id, f"Option {j}"))
+        choices.append((question_id, answer_type, question_options))
+    _insert_chunked(conn, Question.__table__, question_rows)
+    _insert_chunked(conn, Option.__table__, option_rows)
+
+    counts = Counter()
+    responders, response_rows, selection_rows = [], [], []
+
+    def flush():
+        _insert_chunked(conn, Responder.__table__, responders)
+        _insert_chunked(conn, Response.__table__, response_rows)
+        _insert_chunked(conn, AnswerSelection.__table__, selection_rows)
+        responders.clear()
+        response_rows.clear()
+        selection_rows.clear()
+
+    for n in range(responses):
+        responder_id = new_id("responders")
+        created_at = (now - timedelta(seconds=responses - n)).strftime("%Y-%m-%d %H:%M:%S")
+        responders.append({'id': responder_id, 'name': "resp_" + responder_id})
+        for question_id, answer_type, question_options in choices:
+            response_id = new_id("responses")
+            if answer_type == "text":
+                picked = []
+                answer = f"Answer {n}"
+            elif answer_type == "checkbox":
+                picked = rng.sample(question_options, min(2, len(question_options)))
+                answer = ", ".join(text for _, text in picked)
+            else:
+                picked = [rng.choice(question_options)] if question_options else []
+                answer = picked[0][1] if picked else ""
+            response_rows.append({
+                'id': response_id, 'answer': answer, 'createdAt': created_at,
+                'questionId': question_id, 'formId': form_id, 'responderId': responder_id
+            })
+            for option_id, _ in picked:
+                counts[(question_id, option_id)] += 1
+                selection_rows.append({'responseId': response_id, 'optionId': option_id,
+                                       'questionId': question_id, 'formId': form_id})
+        if len(response_rows) >= CHUNK_SIZE:
+            flush()
+    flush()
+
+    _insert_chunked(conn, OptionCount.__table__, [
+        {'optionId': option_id, 'questionId': question_id, 'formId': form_id, 'count': count}
+        for (question_id, option_id), count in counts.items()
+    ])
+    return form_id
+
+
+def seed(app, users=1, forms_per_user=1, questions=20, options=5, responses=1000, random_seed=0):
+    """Create users, each with forms_per_user forms of `responses` responders.
+
+    The first user is "bench_owner" (password "benchmark") so benchmarks can
+    log in. Returns {'owner': username, 'form_ids': [...]}.
+    """
+    from werkzeug.security import generate_password_hash
+    from migrations import upgrade
+    from models import db, User, new_id
+
+    rng = random.Random(random_seed)
+    password = generate_password_hash(OWNER_PASSWORD)
+    form_ids = []
+    owner = None
+    with app.app_context():
+        upgrade()
+        for u in range(users):
+            username = "bench_owner" if u == 0 else f"bench_user_{u}_{new_id('forms')}"
+            if u == 0 and User.query.filter_by(username=username).first() is not None:
+                username = f"bench_owner_{new_id('forms')}"
+            owner = owner or username
+            user_id = new_id("users")
+            with db.engine.begin() as conn:
+                conn.execute(User.__table__.insert(), [{'id': user_id, 'username': username, 'password': password}])
+            for f in range(forms_per_user):
+                with db.engine.begin() as conn:
+                    form_ids.append(seed_form_rows(conn, user_id, questions, options, responses, rng, name=f"Form {f}"))
+    return {'owner': owner, 'form_ids': form_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--forms-per-user", type=int, default=1)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--responses", type=int, default=1000, help="Responders per form")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    app = create_app()
+
+    start = time.perf_counter()
+    seeded = seed(app, args.users, args.forms_per_user, args.questions, args.options, args.responses, args.seed)
+    rows = len(seeded['form_ids']) * args.responses * args.questions
+    print(f"Seeded {len(seeded['form_ids'])} forms and {rows} responses in {time.perf_counter() - start:.1f}s "
+          f"(log in as {seeded['owner']} / {OWNER_PASSWORD})")
+
+
+if __name__ == "__main__":
+    main()
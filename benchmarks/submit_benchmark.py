@@ -0,0 +1,83 @@
+"""Measure form submissions per second through POST /respond/<form_id>.
+
+Runs against a throwaway SQLite database:
+
+    python benchmarks/submit_benchmark.py --questions 50 --submissions 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+
+def load_app(workdir):
+    """Import the app against a scratch database inside workdir"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+    sys.path.insert(0, ROOT)
+
+    from app import create_app
+    from migrations import upgrade
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        upgrade()
+    return app
+
+
+def seed_form(app, questions, options):
+    """Create a user and a form with a mix of question types; returns (form_id, payload)"""
+    from models import db, User, Form, Question, Option, new_id
+
+    answer_types = ["text", "radio", "checkbox", "dropdown"]
+    with app.app_context():
+        user = User(id=new_id("users"), username=f"bench_{new_id('forms')}", password="x")
+        form = Form(id=new_id("forms"), name="bench", title="bench", userId=user.id,
+                    questionCount=questions)
+        db.session.add(user)
+        db.session.flush()  # users has no relationship to forms, so order the inserts by hand
+        db.session.add(form)
+        payload = {}
+        for i in range(questions):
+            answer_type = answer_types[i % len(answer_types)]
+            question = Question(id=new_id("questions"), text=f"Q{i}", answerType=answer_type,
+                                formId=form.id, saved=True, position=i)
+            db.session.add(question)
+            if answer_type == "text":
+                payload[question.id] = f"answer {i}"
+                continue
+            texts = [f"Option {j}" for j in range(options)]
+            for text in texts:
+                db.session.add(Option(id=new_id("options"), text=text, questionId=question.id, formId=form.id))
+            payload[question.id] = texts[:2] if answer_type == "checkbox" else texts[0]
+        db.session.commit()
+        return form.id, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--submissions", type=int, default=300)
+    args = parser.parse_args()
+
+    app = load_app(tempfile.mkdtemp(prefix="forms-bench-"))
+    form_id, payload = seed_form(app, args.questions, args.options)
+
+    # Warm up imports, template and schema caches outside the timed loop
+    app.test_client().post(f"/respond/{form_id}", data=payload)
+
+    start = time.perf_counter()
+    for _ in range(args.submissions):
+        response = app.test_client().post(f"/respond/{form_id}", data=payload)
+        assert response.status_code == 302, response.status_code
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.submissions} submissions of {args.questions} questions in {elapsed:.2f}s "
+          f"-> {args.submissions / elapsed:.1f} submissions/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Benchmark the main request paths and compare the numbers across commits.
+
+Seeds a throwaway SQLite database with seed_data.py, then drives each
+scenario through the Flask test client and reports requests/sec and
+p50/p99 latency. Results are written to benchmarks/results/<time>-<commit>.json
+and compared with the previous results file (or --compare FILE):
+
+    python benchmarks/suite.py --responses 20000 --requests 200
+    python benchmarks/suite.py --only submit,respond_get
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+
+from seed_data import OWNER_PASSWORD, ROOT, seed, seed_form_rows
+from submit_benchmark import load_app
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(request, count, warmup=5):
+    """Call request() count times; returns rps and latency percentiles in ms"""
+    for _ in range(warmup):
+        request()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        request()
+        latencies.append((time.perf_counter() - t) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': count,
+        'rps': round(count / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(sum(latencies) / count, 2),
+    }
+
+
+def expect(response, *statuses):
+    if response.status_code not in statuses:
+        raise AssertionError(f"{response.request.path} returned {response.status_code}")
+    return response
+
+
+def scenarios(app, owner, form_id):
+    """Name -> zero-argument callable performing one request of that scenario"""
+    from models import Option, Question
+
+    with app.app_context():
+        questions = Question.query.filter_by(formId=form_id).all()
+        submit_payload, builder_questions = {}, []
+        for question in questions:
+            options = Option.query.filter_by(questionId=question.id).all()
+            builder_questions.append({'id': question.id, 'text': question.text, 'answerType': question.answerType,
+                                      'options': [{'id': opt.id, 'text': opt.text} for opt in options]})
+            if question.answerType == "text":
+                submit_payload[question.id] = "benchmark answer"
+            elif question.answerType == "checkbox":
+                submit_payload[question.id] = [opt.text for opt in options[:2]]
+            else:
+                submit_payload[question.id] = options[0].text
+
+    owner_client = app.test_client()
+    expect(owner_client.post("/login", data={'username': owner, 'password': OWNER_PASSWORD}), 302)
+    page = expect(owner_client.get(f"/create?form_id={form_id}"), 200).data.decode()
+    csrf = re.search(r'name="csrf-token" content="([^"]+)"', page).group(1)
+
+    respond_client = app.test_client()
+    submit_client = app.test_client()
+    saves = [0]
+
+    def submit():
+        # Every submission comes from a new respondent
+        submit_client.delete_cookie("respondent")
+        expect(submit_client.post(f"/respond/{form_id}", data=submit_payload), 302)
+
+    def builder_save():
+        saves[0] += 1
+        payload = {'name': "Form 0", 'title': f"Saved {saves[0]}", 'description': "", 'questions': builder_questions}
+        expect(owner_client.post("/create", json=payload, headers={'X-CSRFToken': csrf}), 200)
+
+    return {
+        'submit': submit,
+        'respond_get': lambda: expect(respond_client.get(f"/respond/{form_id}"), 200),
+        'builder_save': builder_save,
+        'dashboard': lambda: expect(owner_client.get("/"), 200),
+        'statistics': lambda: expect(owner_client.get(f"/responses_statistics/{form_id}"), 200),
+        'responses_page': lambda: expect(owner_client.get(f"/responses_statistics/{form_id}/responses"), 200),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def previous_results(exclude):
+    paths = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if p != exclude)
+    return paths[-1] if paths else None
+
+
+def print_report(results, baseline=None):
+    base = baseline["scenarios"] if baseline else {}
+    if baseline:
+        print(f"Compared with {baseline['commit']} ({baseline['timestamp']})")
+    print(f"{'scenario':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'req/s change':>15}")
+    for name, row in results["scenarios"].items():
+        change = ""
+        if name in base and base[name]["rps"]:
+            change = f"{(row['rps'] / base[name]['rps'] - 1) * 100:+.1f}%"
+        print(f"{name:<16}{row['rps']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}{change:>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--forms", type=int, default=20, help="Forms on the owner's dashboard")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--responses", type=int, default=5000, help="Responders of the benchmarked form")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario")
+    parser.add_argument("--only", default="", help="Comma-separated scenarios to run")
+    parser.add_argument("--compare", default=None, help="Results file to compare with (default: the latest)")
+    parser.add_argument("--no-save", action="store_true", help="Do not write a results file")
+    args = parser.parse_args()
+
+    app = load_app(tempfile.mkdtemp(prefix="forms-bench-"))
+    start = time.perf_counter()
+    seeded = seed(app, users=1, forms_per_user=1, questions=args.questions, options=args.options,
+                  responses=args.responses)
+    form_id = seeded['form_ids'][0]
+    # Small extra forms only fill the dashboard
+    with app.app_context():
+        from models import db, User
+        owner_id = User.query.filter_by(username=seeded['owner']).first().id
+        with db.engine.begin() as conn:
+            for i in range(1, args.forms):
+                seed_form_rows(conn, owner_id, 5, 3, 10, random.Random(i), name=f"Form {i}")
+    print(f"Seeded {args.responses * args.questions} responses in {time.perf_counter() - start:.1f}s")
+
+    available = scenarios(app, seeded['owner'], form_id)
+    selected = [name.strip() for name in args.only.split(",") if name.strip()] or list(available)
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'config': {k: v for k, v in vars(args).items() if k not in ("compare", "no_save", "only")},
+        'scenarios': {},
+    }
+    for name in selected:
+        results['scenarios'][name] = measure(available[name], args.requests)
+
+    saved = None if args.no_save else save_results(results)
+    baseline_path = args.compare or previous_results(saved)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if saved:
+        print(f"Results written to {os.path.relpath(saved, ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,97 @@ from flask_login import LoginManager, login_required, current_user
 from flask import Blueprint
 from flask_wtf.csrf import generate_csrf, validate_csrf
 
-from models import db,Form, Question, Option,generate_random_id
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from models import db,Form, Question, Option,Response,AnswerSelection,OptionCount,new_id
+from schema_cache import form_schema_cache
+from fragments import respond_fragments
+from duplicates import SUBMISSION_POLICIES
 
 builder_bp = Blueprint('builder', __name__)
 
 ANSWER_options=["text","radio","checkbox","dropdown"]
+FORM_ID_RETRIES = 3
+
+def save_questions(form, questions):
+    """Diff submitted questions against the stored ones by id and apply the changes.
+
+    Questions and options whose id matches a stored row are updated in place
+    (only when something changed), unknown ids are inserted and stored rows
+    that were not submitted are deleted along with their responses. Untouched
+    questions keep their responses. Nothing is committed here. Returns the
+    number of questions the form ends up with. Each question's position is
+    its place in the submitted list, which is the order every page shows.
+    """
+    stored = {q.id: q for q in Question.query.options(
+        selectinload(Question.options)
+    ).filter_by(formId=form.id).all()}
+
+    kept_questions = set()
+    removed_options = []
+    for question_data in questions:
+        question_text = (question_data.get("text") or "").strip()
+        answer_type = (question_data.get("answerType") or "").strip()
+        options = question_data.get("options") or []
+
+        if not question_text or answer_type not in ANSWER_options:
+            continue
+
+        option_rows = []
+        if answer_type != "text":
+            for option_data in options:
+                option_text = (option_data.get("text") or "").strip()
+                if option_text:
+                    option_rows.append((str(option_data.get("id")), option_text))
+
+        position = len(kept_questions)
+        question = stored.get(str(question_data.get("id")))
+        if question is None or question.id in kept_questions:
+            question = Question(id=new_id("questions"), formId=form.id, saved=True, position=position)
+            db.session.add(question)
+            stored_options = {}
+        else:
+            stored_options = {opt.id: opt for opt in question.options}
+        kept_questions.add(question.id)
+
+        if question.text != question_text:
+            question.text = question_text
+        if question.answerType != answer_type:
+            question.answerType = answer_type
+        if question.optionCount != len(option_rows):
+            question.optionCount = len(option_rows)
+        if not question.saved:
+            question.saved = True
+        if question.position != position:
+            question.position = position
+
+        kept_options = set()
+        for option_id, option_text in option_rows:
+            option = stored_options.get(option_id)
+            if option is None or option.id in kept_options:
+                db.session.add(Option(id=new_id("options"), text=option_text, questionId=question.id, formId=form.id))
+                continue
+            kept_options.add(option.id)
+            if option.text != option_text:
+                option.text = option_text
+        removed_options += [option_id for option_id in stored_options if option_id not in kept_options]
+
+    removed_questions = [question_id for question_id in stored if question_id not in kept_questions]
+    removed_options += [opt.id for question_id in removed_questions for opt in stored[question_id].options]
+
+    # Bulk deletes, children first, so large forms don't load their responses
+    if removed_options:
+        AnswerSelection.query.filter(AnswerSelection.optionId.in_(removed_options)).delete(synchronize_session=False)
+        OptionCount.query.filter(OptionCount.optionId.in_(removed_options)).delete(synchronize_session=False)
+        Option.query.filter(Option.id.in_(removed_options)).delete(synchronize_session=False)
+    if removed_questions:
+        AnswerSelection.query.filter(AnswerSelection.questionId.in_(removed_questions)).delete(synchronize_session=False)
+        Response.query.filter(Response.questionId.in_(removed_questions)).delete(synchronize_session=False)
+        Question.query.filter(Question.id.in_(removed_questions)).delete(synchronize_session=False)
+
+    return len(kept_questions)
+
 
 @builder_bp.route("/create" ,methods = ["GET","POST"])
 @login_required
@@ -25,20 +111,23 @@ def create():
             session["form_id"] = 0
 
         if session["form_id"] == 0:
-            # Generate unique ID for new form
-            form_id = generate_random_id()
-            while Form.query.get(form_id):
-                form_id = generate_random_id()
-                
-            new_form = Form(id=form_id, name="", title="", userId=current_user.id)
-            db.session.add(new_form)
-            db.session.commit()
+            # Short random ID for the URL; on the rare collision, retry with a new one
+            for attempt in range(FORM_ID_RETRIES):
+                new_form = Form(id=new_id("forms"), name="", title="", userId=current_user.id)
+                db.session.add(new_form)
+                try:
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    db.session.rollback()
+                    if attempt == FORM_ID_RETRIES - 1:
+                        raise
             form = new_form
             session["form_id"] = form.id
         else:
             form = Form.query.filter_by(id=session["form_id"]).first()
 
-        questions = Question.query.filter_by(formId=form.id, saved=True).all()
+        questions = Question.query.filter_by(formId=form.id, saved=True).order_by(Question.position, Question.id).all()
         question_list = []
         for q in questions:
             options = Option.query.filter_by(questionId=q.id).all()
@@ -54,6 +143,7 @@ def create():
             "name": form.name,
             "title": form.title,
             "description": form.description or "",
+            "submissionPolicy": form.submissionPolicy or "",
             "questions": question_list
         }
 
@@ -79,10 +169,13 @@ def create():
             form_name = data.get("name", "").strip()
             form_title = data.get("title", "").strip()
             form_description = data.get("description", "").strip()
+            submission_policy = (data.get("submissionPolicy") or "").strip() or None
             questions = data.get("questions", [])
 
             if not form_name or not form_title:
                 return jsonify(success=False, error="Form name and title are required"), 400
+            if submission_policy is not None and submission_policy not in SUBMISSION_POLICIES:
+                return jsonify(success=False, error="Invalid submission policy"), 400
 
             form_id = session.get("form_id")
             form = Form.query.get(form_id)
@@ -94,67 +187,16 @@ def create():
             form.name = form_name
             form.title = form_title
             form.description = form_description
-            form.questionCount = 0
-            form.responsesCount = 0
-            db.session.commit()
-
-            # Clear previous questions and options
-            previous_questions = Question.query.filter_by(formId=form.id).all()
-            for pq in previous_questions:
-                Option.query.filter_by(questionId=pq.id).delete()
-            Question.query.filter_by(formId=form.id).delete()
-            db.session.commit()
+            form.submissionPolicy = submission_policy
+            form.version = (form.version or 0) + 1
+            form.updatedAt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            # print(f"\n===== UPDATING EXISTING FORM =====")
-            # print(f"Form ID: {form.id}")
-            # print(f"Name: '{form.name}'")
-            # print(f"Title: '{form.title}'")
-            # print(f"Questions: {questions}")
-            # print(f"===========================\n")
-
-            # Add new questions and options
-            for question_data in questions:
-                question_text = question_data.get("text", "").strip()
-                answer_type = question_data.get("answerType", "").strip()
-                options = question_data.get("options") or []
-
-                if not question_text or answer_type not in ["text", "radio", "checkbox", "dropdown"]:
-                    continue
-
-                # Generate unique ID for new question
-                question_id = generate_random_id()
-                while Question.query.get(question_id):
-                    question_id = generate_random_id()
-
-                new_question = Question(
-                    id=question_id,
-                    text=question_text,
-                    answerType=answer_type,
-                    formId=form.id,
-                    optionCount=len(options) if answer_type != "text" else 0,
-                    saved=True
-                )
-                form.questionCount+= 1
-                db.session.add(new_question)
-                db.session.commit()
-
-                for option_data in options:
-                    option_text = option_data.get("text", "").strip()
-                    if option_text:
-                        # Generate unique ID for new option
-                        option_id = generate_random_id()
-                        while Option.query.get(option_id):
-                            option_id = generate_random_id()
-                            
-                        new_option = Option(
-                            id=option_id,
-                            text=option_text,
-                            questionId=new_question.id,
-                            formId=form.id
-                        )
-                        db.session.add(new_option)
+            # Apply only what changed since the last save, in one transaction
+            form.questionCount = save_questions(form, questions)
 
             db.session.commit()
+            form_schema_cache.invalidate(form.id, form.version)
+            respond_fragments.invalidate(form.id)
             return jsonify(success=True, formId=form.id)
 
         except Exception as e:
@@ -178,6 +220,8 @@ def delete():
         
         db.session.delete(form)
         db.session.commit()
+        form_schema_cache.invalidate(form_id)
+        respond_fragments.invalidate(form_id)
         
         return jsonify({'success': True, 'message': 'Form deleted successfully'})
         
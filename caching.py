@@ -0,0 +1,134 @@
+from datetime import datetime
+import hashlib
+import os
+import threading
+
+from flask import current_app, request, session, url_for
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_static_hashes = {}
+_lock = threading.Lock()
+_site_fingerprint = ""
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def static_hash(app, filename):
+    """Short content hash of a static file, recomputed only when its mtime changes"""
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        cached = _static_hashes.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    short = _file_hash(path)[:12]
+    with _lock:
+        _static_hashes[filename] = (mtime, short)
+    return short
+
+
+def static_url(filename):
+    """URL of a static file carrying its content hash, safe to cache forever"""
+    version = static_hash(current_app, filename)
+    if version is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=version)
+
+
+def site_fingerprint(app):
+    """Hash of every template and static file, so a deploy changes every page ETag"""
+    digest = hashlib.sha256()
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, app.root_path).encode())
+                digest.update(_file_hash(path).encode())
+    return digest.hexdigest()[:16]
+
+
+def form_page_etag(form):
+    """ETag of a public form page: the form version plus the session's CSRF token.
+
+    The token is part of the page, so a page cached by one session is never
+    revalidated for another one.
+    """
+    token = session.get("csrf_token", "")
+    key = f"{form.id}:{form.version}:{form.submissionPolicy}:{token}:{_site_fingerprint}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def form_last_modified(form):
+    """When the form was last saved, as an aware datetime (timestamps are stored in local time)"""
+    if not form.updatedAt:
+        return None
+    try:
+        return datetime.strptime(form.updatedAt, "%Y-%m-%d %H:%M:%S").astimezone()
+    except ValueError:
+        return None
+
+
+def is_fresh(etag, last_modified=None):
+    """True if the client's cached copy (If-None-Match / If-Modified-Since) is current"""
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def cache_form_page(response, etag, last_modified=None):
+    """Let browsers keep a form page and revalidate it with a conditional GET"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True  # Carries a per-session CSRF token
+    response.cache_control.no_cache = True  # Always revalidate; unchanged pages cost a 304
+    return response
+
+
+def apply_cache_policy(response):
+    """Route-aware Cache-Control, applied after every request.
+
+    Hashed static URLs (?v=<content hash>) are immutable for a year, other
+    static requests are revalidated against the file's ETag, views that set
+    their own Cache-Control keep it, and everything else (authenticated and
+    per-user pages) is not stored at all.
+    """
+    if request.endpoint == "static":
+        filename = (request.view_args or {}).get("filename", "")
+        version = request.args.get("v")
+        if version and response.status_code in (200, 304) and version == static_hash(current_app, filename):
+            response.cache_control.no_cache = None  # send_file's default when no max_age is configured
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    if "Cache-Control" in response.headers:
+        return response
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Expires"] = 0
+    response.headers["Pragma"] = "no-cache"
+    return response
+
+
+def init_caching(app):
+    """Fingerprint the templates and static files and expose static_url() to templates"""
+    global _site_fingerprint
+    _site_fingerprint = site_fingerprint(app)
+    app.jinja_env.globals["static_url"] = static_url
@@ -0,0 +1,70 @@
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Per-connection SQLite settings, applied every time the pool opens a connection
+SQLITE_PRAGMAS = {
+    "journal_mode": config('SQLITE_JOURNAL_MODE', default='WAL'),
+    "synchronous": config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    "busy_timeout": config('SQLITE_BUSY_TIMEOUT_MS', default=5000, cast=int),
+    "cache_size": -config('SQLITE_CACHE_SIZE_KB', default=20000, cast=int),  # negative means KiB
+    "mmap_size": config('SQLITE_MMAP_SIZE', default=268435456, cast=int),
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    SQLite gets a small thread-shared connection pool and a busy timeout so
+    concurrent writers wait instead of failing with "database is locked";
+    any other database (e.g. DATABASE_URL=postgresql://...) gets a regular
+    pool with pre-ping and recycling.
+    """
+    pool_size = config('DB_POOL_SIZE', default=5, cast=int)
+    max_overflow = config('DB_MAX_OVERFLOW', default=10, cast=int)
+    pool_timeout = config('DB_POOL_TIMEOUT', default=30, cast=int)
+
+    if database_uri.startswith("sqlite"):
+        if ":memory:" in database_uri or database_uri.rstrip("/") == "sqlite:":
+            # An in-memory database lives in one connection; keep the default pool
+            return {"connect_args": {"check_same_thread": False}}
+        return {
+            "poolclass": QueuePool,
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+            },
+        }
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": config('DB_POOL_RECYCLE', default=1800, cast=int),
+        "pool_pre_ping": True,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def configure_engine(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS; call before db.init_app(app)"""
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def register_pragmas(app, db):
+    """Apply SQLITE_PRAGMAS to every new connection of the app's engine"""
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite" and not event.contains(db.engine, "connect", _apply_sqlite_pragmas):
+            event.listen(db.engine, "connect", _apply_sqlite_pragmas)
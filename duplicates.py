@@ -0,0 +1,93 @@
+import re
+import secrets
+
+from flask import g, request
+from flask_login import current_user
+from lru import LRUCache
+from models import db, FormSubmitter
+
+POLICY_MULTIPLE = "multiple"  # Anyone may submit any number of times
+POLICY_BROWSER = "browser"    # One submission per browser (respondent cookie)
+POLICY_USER = "user"          # One submission per logged-in user; anonymous visitors must log in
+SUBMISSION_POLICIES = (POLICY_MULTIPLE, POLICY_BROWSER, POLICY_USER)
+
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{22,43}$")
+
+
+class AlreadySubmitted(Exception):
+    """The submitter already has a submission for this form"""
+
+
+class DuplicateGuard:
+    """Decides whether a visitor already submitted a form.
+
+    A submission under a restrictive policy carries a submitter key, and a
+    (form id, submitter key) row of form_submitters is written in the same
+    transaction as the responses (see write_submissions), so the claim costs
+    no extra write and the primary key keeps it atomic across processes. Keys
+    are "b:<token>" for the long-lived respondent cookie and "u:<user id>" for
+    logged-in users. Keys known to have submitted are kept in a bounded
+    in-process set, so a returning visitor does not touch the database at all.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.default_policy = POLICY_BROWSER
+        self.cookie_name = "respondent"
+        self.cookie_max_age = 365 * 24 * 3600
+        self._seen = LRUCache(max_entries)
+
+    def init_app(self, app):
+        self.default_policy = app.config.get("DUPLICATE_POLICY", self.default_policy)
+        if self.default_policy not in SUBMISSION_POLICIES:
+            raise ValueError(f"DUPLICATE_POLICY must be one of {', '.join(SUBMISSION_POLICIES)}")
+        self._seen = LRUCache(app.config.get("DUPLICATE_CACHE_SIZE", self._seen.max_entries))
+        self.cookie_name = app.config.get("RESPONDENT_COOKIE_NAME", self.cookie_name)
+        app.after_request(self._set_token_cookie)
+
+    def policy(self, form):
+        return form.submissionPolicy or self.default_policy
+
+    def respondent_token(self):
+        """This browser's respondent token, issued with the response if it has none"""
+        token = getattr(g, "respondent_token", None)
+        if token is None:
+            token = request.cookies.get(self.cookie_name, "")
+            if not TOKEN_PATTERN.match(token):
+                token = secrets.token_urlsafe(16)
+                g.new_respondent_token = True
+            g.respondent_token = token
+        return token
+
+    def _set_token_cookie(self, response):
+        if g.get("new_respondent_token"):
+            response.set_cookie(
+                self.cookie_name, g.respondent_token, max_age=self.cookie_max_age,
+                httponly=True, samesite="Lax", secure=request.is_secure
+            )
+        return response
+
+    def submitter_key(self, form):
+        """The key a submission to form is checked against, or None if nothing is checked"""
+        policy = self.policy(form)
+        if policy == POLICY_USER:
+            return f"u:{current_user.id}" if current_user.is_authenticated else None
+        if policy == POLICY_BROWSER:
+            return f"b:{self.respondent_token()}"
+        return None
+
+    def remember(self, form_id, key):
+        """Note that key has submitted form_id"""
+        self._seen.set((form_id, key), True)
+
+    def has_submitted(self, form_id, key):
+        if key is None or (key.startswith("b:") and g.get("new_respondent_token")):
+            return False  # A token issued by this very request cannot have submitted
+        if self._seen.get((form_id, key)):
+            return True
+        found = db.session.query(FormSubmitter.formId).filter_by(formId=form_id, submitterKey=key).first()
+        if found is not None:
+            self.remember(form_id, key)
+        return found is not None
+
+
+duplicate_guard = DuplicateGuard()
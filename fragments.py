@@ -0,0 +1,58 @@
+from flask import render_template
+from markupsafe import Markup
+
+from lru import LRUCache
+
+
+class FragmentCache:
+    """In-process LRU cache of rendered HTML fragments.
+
+    Entries are keyed by (form id, form version), so a builder save makes the
+    old fragment unreachable even before invalidate() drops it. Fragments must
+    not contain anything per-request (CSRF tokens, user names); those stay in
+    the page template that includes the fragment.
+    """
+
+    def __init__(self, max_entries=512):
+        self._entries = LRUCache(max_entries)
+
+    def init_app(self, app):
+        self._entries = LRUCache(app.config.get("RESPOND_FRAGMENT_CACHE_SIZE", self._entries.max_entries))
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, html):
+        self._entries.set(key, html)
+
+    def invalidate(self, form_id):
+        """Drop every cached fragment of a form after it was saved or deleted"""
+        self._entries.discard_where(lambda key: key[0] == form_id)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+respond_fragments = FragmentCache()
+
+
+def render_questions(form):
+    """The question cards of the respond page for a compiled form, rendered once per version"""
+    key = (form.id, form.version)
+    html = respond_fragments.get(key)
+    if html is None:
+        html = Markup(render_template("respond_questions.html", questions=form.questions, options_map=form.options_map))
+        respond_fragments.set(key, html)
+    return html
+
+
+def precompile_templates(app):
+    """Compile every template up front so the first request to each page is not slowed by Jinja"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+        compiled += 1
+    return compiled
@@ -1,47 +1,105 @@
 from flask import Blueprint, render_template, redirect, url_for, request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy import or_, tuple_
 from models import Form
 from models import db
-from sqlalchemy import or_
+from maintenance import empty_form_filter
 # Blueprint name should be 'home' to match the import in app.py
 home_bp = Blueprint('home', __name__)
 
+FORMS_PAGE_SIZE = 25
+MAX_FORMS_PAGE_SIZE = 200
+
+# sort name -> (key column, descending)
+FORM_SORTS = {
+    'newest': (Form.createdAt, True),
+    'oldest': (Form.createdAt, False),
+    'name': (Form.name, False),
+}
+
+# Only the columns index.html shows (plus title for search results)
+LISTING_COLUMNS = (Form.id, Form.name, Form.title, Form.createdAt, Form.responsesCount, Form.questionCount)
+
+
+def forms_page_query(user_id, sort='newest', search=None, after=None, limit=FORMS_PAGE_SIZE):
+    """The query behind one dashboard page (limit + 1 rows); also checked by `flask check-query-plans`.
+
+    Pages are keyed on (sort column, id), which the (userId, createdAt, id)
+    and (userId, name, id) indexes serve in order, so a deep page costs the
+    same as the first. `search` matches any part of the name or title; that
+    filter runs over the user's rows the index already narrowed to, as no
+    index can serve a leading wildcard. `after` is the (key, id) cursor of
+    the previous page.
+    """
+    key, descending = FORM_SORTS.get(sort, FORM_SORTS['newest'])
+    query = db.session.query(*LISTING_COLUMNS).filter(Form.userId == user_id, ~empty_form_filter())
+
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%"
+        query = query.filter(or_(Form.name.ilike(pattern, escape="\\"), Form.title.ilike(pattern, escape="\\")))
+
+    if after:
+        # Row values, so the cursor is one range on the (userId, key, id) index
+        if descending:
+            query = query.filter(tuple_(key, Form.id) < tuple_(*after))
+        else:
+            query = query.filter(tuple_(key, Form.id) > tuple_(*after))
+
+    order = (key.desc(), Form.id.desc()) if descending else (key.asc(), Form.id.asc())
+    return query.order_by(*order).limit(limit + 1)
+
+
+def list_forms(user_id, sort='newest', search=None, after=None, limit=FORMS_PAGE_SIZE):
+    """Return one page of a user's finished forms and the cursor of the next page (see forms_page_query)"""
+    key, _ = FORM_SORTS.get(sort, FORM_SORTS['newest'])
+    rows = forms_page_query(user_id, sort, search, after, limit).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = {'key': getattr(last, key.key), 'id': last.id}
+    return rows, next_cursor
+
 
 @home_bp.route('/',methods=['GET','POST'])
 @login_required
 def index():
     try:
-        empty_forms = Form.query.filter(Form.userId == current_user.id,
-            or_(Form.name == "", Form.title == "", Form.questionCount <= 0)
-        ).all()
+        sort = request.args.get('sort', 'newest')
+        if sort not in FORM_SORTS:
+            sort = 'newest'
+        search = request.args.get('q', '').strip()
+        limit = min(max(request.args.get('limit', FORMS_PAGE_SIZE, type=int), 1), MAX_FORMS_PAGE_SIZE)
+        after = None
+        if request.args.get('after_id'):
+            after = (request.args.get('after_key', ''), request.args.get('after_id'))
 
-        for form in empty_forms:
-            db.session.delete(form)
-        db.session.commit()
-        
-        # Get user's forms
-        forms = Form.query.filter_by(userId=current_user.id).all()
+        # Get one page of the user's finished forms; unfinished ones are removed by `flask sweep-empty-forms`
+        forms, next_cursor = list_forms(current_user.id, sort=sort, search=search, after=after, limit=limit)
         
-        # if request.is_json:
-        #     # Return JSON for AJAX requests
-        #     return jsonify({
-        #         'success': True,
-        #         'forms': [
-        #             {
-        #                 'formId': form.id,
-        #                 'name': form.name,
-        #                 'title': form.title,
-        #                 'createdAt': form.createdAt,
-        #                 'responsesCount': form.responsesCount,
-        #                 'questionCount': form.questionCount
-        #             } for form in forms
-        #         ]
-        #     })
+        if request.is_json or request.args.get('format') == 'json':
+            # Return JSON for AJAX requests
+            return jsonify({
+                'success': True,
+                'forms': [
+                    {
+                        'formId': form.id,
+                        'name': form.name,
+                        'title': form.title,
+                        'createdAt': form.createdAt,
+                        'responsesCount': form.responsesCount,
+                        'questionCount': form.questionCount
+                    } for form in forms
+                ],
+                'next': next_cursor
+            })
         
-        return render_template('index.html', forms=forms)
+        return render_template('index.html', forms=forms, next_cursor=next_cursor,
+                               sort=sort, search=search, paged=bool(after))
     
     except Exception as e:
         if request.is_json:
             return jsonify({'success': False, 'error': str(e)})
         return f"An error occurred: {str(e)}", 500
-
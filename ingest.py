@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from duplicates import AlreadySubmitted
+from models import db, Responder
+from schema_cache import form_schema_cache, get_form_schema
+from submissions import write_submissions
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionQueue:
+    """Durable queue of validated submissions, drained into the main database in batches.
+
+    The queue is its own SQLite file, so appending a submission never waits
+    on the main database's writer. Any number of processes can enqueue and
+    drain: a worker claims a batch with one UPDATE before writing it, claims
+    left behind by a crashed worker expire after `claim_timeout` seconds, and
+    a submission whose responder already exists is treated as done, so a
+    batch replayed after a crash is not written twice. A submission that
+    fails `max_attempts` times is kept, logged and listed by `failed()`.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.path = None
+        self.batch_size = 500
+        self.interval = 0.2
+        self.claim_timeout = 60
+        self.max_attempts = 5
+        self.worker_id = None
+        self._claimer_pid = None
+        self._local = threading.local()
+        self._worker = None
+        self._worker_pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("SUBMISSION_QUEUE_ENABLED", False)
+        self.path = app.config.get("SUBMISSION_QUEUE_PATH") or os.path.join(app.instance_path, "submission_queue.db")
+        self.batch_size = app.config.get("SUBMISSION_QUEUE_BATCH_SIZE", self.batch_size)
+        self.interval = app.config.get("SUBMISSION_QUEUE_INTERVAL", self.interval)
+        if self.enabled:
+            # Each process starts its writer with its first request, so a parent
+            # that forks workers never runs one; it picks up anything left from
+            # before a restart
+            app.before_request(self.start_worker)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS submission_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    claimed_by TEXT,
+                    claimed_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS submitter_claims (
+                    form_id TEXT NOT NULL,
+                    submitter_key TEXT NOT NULL,
+                    queue_id INTEGER NOT NULL,
+                    PRIMARY KEY (form_id, submitter_key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_submitter_claims_queue_id ON submitter_claims (queue_id)")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, form_id, responder_id, created_at, answers_by_question, submitter_key=None):
+        """Persist one validated submission; it is written to the main database later.
+
+        A submitter key is claimed in the queue file, in the same transaction,
+        so a duplicate is refused without touching the main database: raises
+        AlreadySubmitted if the key already has a queued submission.
+        """
+        payload = json.dumps({
+            "form_id": form_id,
+            "responder_id": responder_id,
+            "created_at": created_at,
+            "answers": answers_by_question,
+            "submitter_key": submitter_key,
+        })
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            queue_id = conn.execute("INSERT INTO submission_queue (payload) VALUES (?)", (payload,)).lastrowid
+            if submitter_key is not None:
+                conn.execute("INSERT INTO submitter_claims (form_id, submitter_key, queue_id) VALUES (?, ?, ?)",
+                             (form_id, submitter_key, queue_id))
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            raise AlreadySubmitted()
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.start_worker()
+
+    def pending(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM submission_queue WHERE attempts < ?", (self.max_attempts,)
+        ).fetchone()[0]
+
+    def failed(self):
+        """Submissions that failed max_attempts times and are no longer retried: [(id, payload dict)]"""
+        rows = self._connect().execute(
+            "SELECT id, payload FROM submission_queue WHERE attempts >= ? ORDER BY id", (self.max_attempts,)
+        ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def retry_failed(self):
+        """Give every failed submission a fresh set of attempts; returns how many"""
+        return self._connect().execute(
+            "UPDATE submission_queue SET attempts = 0, claimed_by = NULL WHERE attempts >= ?", (self.max_attempts,)
+        ).rowcount
+
+    def _claimer(self):
+        # Unique per process, including forked children of a preloaded parent
+        if self._claimer_pid != os.getpid():
+            self._claimer_pid = os.getpid()
+            self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        return self.worker_id
+
+    def _claim(self):
+        self._claimer()
+        conn = self._connect()
+        now = time.time()
+        conn.execute("""
+            UPDATE submission_queue SET claimed_by = ?, claimed_at = ?
+            WHERE id IN (
+                SELECT id FROM submission_queue
+                WHERE (claimed_by IS NULL OR claimed_at < ?) AND attempts < ?
+                ORDER BY id LIMIT ?
+            )
+        """, (self.worker_id, now, now - self.claim_timeout, self.max_attempts, self.batch_size))
+        return conn.execute(
+            "SELECT id, payload FROM submission_queue WHERE claimed_by = ? ORDER BY id", (self.worker_id,)
+        ).fetchall()
+
+    def _write(self, submissions):
+        try:
+            rejected = write_submissions([submission for _, submission in submissions])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self._delete([row_id for row_id, _ in submissions])
+        if rejected:
+            logger.info("Dropped %d queued submissions from submitters who had already submitted", len(rejected))
+
+    def _delete(self, row_ids):
+        # The main database now holds the submitter row, so the queue's claim goes too
+        conn = self._connect()
+        conn.executemany("DELETE FROM submitter_claims WHERE queue_id = ?", [(row_id,) for row_id in row_ids])
+        conn.executemany("DELETE FROM submission_queue WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def _fail(self, row_id, item):
+        """Charge a failed attempt to one submission and release it for a retry"""
+        conn = self._connect()
+        conn.execute("UPDATE submission_queue SET attempts = attempts + 1, claimed_by = NULL WHERE id = ?", (row_id,))
+        form_schema_cache.discard(item["form_id"])  # A stale schema (e.g. a deleted form) is reloaded on the retry
+        attempts = conn.execute("SELECT attempts FROM submission_queue WHERE id = ?", (row_id,)).fetchone()[0]
+        if attempts >= self.max_attempts:
+            logger.error("Queued submission %s (form %s, responder %s) failed %d times and is no longer retried; "
+                         "see `flask failed-submissions`", row_id, item["form_id"], item["responder_id"], attempts)
+
+    def drain_once(self):
+        """Write one claimed batch; returns how many submissions were taken.
+
+        The batch is written in one transaction. If that fails, each submission
+        is retried on its own so only the one that fails is charged an attempt.
+        """
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        items = [(row_id, json.loads(payload)) for row_id, payload in rows]
+        responder_ids = [item["responder_id"] for _, item in items]
+        done = {row[0] for row in db.session.query(Responder.id).filter(Responder.id.in_(responder_ids))}
+
+        skipped, submissions = [], []
+        for row_id, item in items:
+            form = None if item["responder_id"] in done else get_form_schema(item["form_id"])
+            if form is None:
+                skipped.append(row_id)  # Already written, or the form was deleted while it waited
+                continue
+            submissions.append((row_id, (form, item["answers"], item["responder_id"], item["created_at"],
+                                         item.get("submitter_key"))))
+        self._delete(skipped)
+
+        try:
+            self._write(submissions)
+        except Exception:
+            # Retry one by one so a single bad submission only fails itself
+            payloads = dict(items)
+            for row_id, submission in submissions:
+                try:
+                    self._write([(row_id, submission)])
+                except Exception:
+                    logger.exception("Writing queued submission %s failed", row_id)
+                    self._fail(row_id, payloads[row_id])
+        return len(items)
+
+    def drain(self):
+        """Drain until the queue is empty; returns the number of submissions taken"""
+        total = 0
+        while True:
+            taken = self.drain_once()
+            if not taken:
+                return total
+            total += taken
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    taken = self.drain_once()
+                except Exception:
+                    logger.exception("Writing queued submissions failed; they will be retried")
+                    taken = 0
+                finally:
+                    db.session.remove()
+                if not taken:
+                    self._stop.wait(self.interval)
+
+    def start_worker(self):
+        """Start this process's background writer if it is not running (e.g. after a fork)"""
+        if not self.enabled:
+            return
+        worker = self._worker
+        if worker is not None and self._worker_pid == os.getpid() and worker.is_alive():
+            return  # Checked on every request; skip the lock in the common case
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._stop.clear()
+            self._worker_pid = os.getpid()
+            self._local = threading.local()  # Connections must not cross a fork
+            self._worker = threading.Thread(target=self._run, name="submission-queue-writer", daemon=True)
+            self._worker.start()
+
+    def stop_worker(self, timeout=5):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+
+submission_queue = SubmissionQueue()
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from models import db, Form
+
+
+def empty_form_filter():
+    """Forms that were never finished: no name, no title or no questions"""
+    return or_(Form.name == "", Form.title == "", Form.questionCount <= 0)
+
+
+def sweep_empty_forms(older_than=timedelta(hours=24), batch_size=200, user_id=None):
+    """Delete unfinished forms created more than `older_than` ago.
+
+    The builder creates an empty form as soon as /create is opened, so the
+    age threshold keeps forms that are still being edited. Forms are deleted
+    `batch_size` at a time, one short transaction per batch, so the sweep
+    never holds the write lock for long. Returns the number of forms deleted.
+    """
+    cutoff = (datetime.now() - older_than).strftime("%Y-%m-%d %H:%M:%S")
+    deleted = 0
+    while True:
+        query = Form.query.filter(empty_form_filter(), Form.createdAt < cutoff)
+        if user_id is not None:
+            query = query.filter(Form.userId == user_id)
+        batch = query.limit(batch_size).all()
+        if not batch:
+            return deleted
+        for form in batch:
+            db.session.delete(form)
+        db.session.commit()
+        deleted += len(batch)
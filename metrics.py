@@ -0,0 +1,153 @@
+from collections import defaultdict
+import bisect
+import hmac
+import logging
+import threading
+import time
+import warnings
+
+from flask import Response, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """A Prometheus-style histogram with one series per endpoint label"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0, 0])  # bucket counts, sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[endpoint]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {endpoint: ([*counts], total, count) for endpoint, (counts, total, count) in self._series.items()}
+        for endpoint in sorted(snapshot):
+            counts, total, count = snapshot[endpoint]
+            label = endpoint.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{endpoint="{label}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{endpoint="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{endpoint="{label}"}} {count}')
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class RequestMetrics:
+    """Per-request query count, SQL time, render time and response size, per endpoint.
+
+    Engine events count the statements a request runs and the time spent in
+    them, template signals time rendering, and after_request folds it all into
+    histograms served in the Prometheus text format on /metrics. Numbers are
+    per process; scrape every worker. A request running more than
+    `query_warn_threshold` statements is logged as a likely N+1.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.query_warn_threshold = 20
+        self.token = ""
+        self.request_seconds = Histogram("forms_request_duration_seconds", "Time to handle a request", LATENCY_BUCKETS)
+        self.sql_queries = Histogram("forms_request_sql_queries", "SQL statements run by a request", COUNT_BUCKETS)
+        self.sql_seconds = Histogram("forms_request_sql_duration_seconds", "Time a request spent in SQL", LATENCY_BUCKETS)
+        self.render_seconds = Histogram("forms_request_render_duration_seconds", "Time a request spent rendering templates", LATENCY_BUCKETS)
+        self.response_bytes = Histogram("forms_response_size_bytes", "Size of response bodies", SIZE_BUCKETS)
+        self.histograms = [self.request_seconds, self.sql_queries, self.sql_seconds, self.render_seconds, self.response_bytes]
+
+    def init_app(self, app, db):
+        self.enabled = app.config.get("METRICS_ENABLED", self.enabled)
+        self.query_warn_threshold = app.config.get("METRICS_QUERY_WARN_THRESHOLD", self.query_warn_threshold)
+        self.token = app.config.get("METRICS_TOKEN", self.token)
+        if not self.enabled:
+            return
+        if not self.token:
+            warnings.warn("METRICS_ENABLED without METRICS_TOKEN serves /metrics to anyone; set METRICS_TOKEN")
+
+        with app.app_context():
+            engine = db.engine
+        if not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    # SQL: only statements run on behalf of a request are counted, not background writers
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_started" in g:
+            conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if starts and has_request_context() and "metrics_started" in g:
+            g.metrics_sql_seconds += time.perf_counter() - starts.pop()
+            g.metrics_queries += 1
+
+    def _before_render(self, app, template, context, **extra):
+        if "metrics_started" in g:
+            g.metrics_render_starts.append(time.perf_counter())
+
+    def _after_render(self, app, template, context, **extra):
+        if "metrics_started" in g and g.metrics_render_starts:
+            started = g.metrics_render_starts.pop()
+            if not g.metrics_render_starts:  # Nested renders are already inside the outer one
+                g.metrics_render_seconds += time.perf_counter() - started
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_render_seconds = 0.0
+        g.metrics_render_starts = []
+
+    def _finish_request(self, response):
+        if "metrics_started" not in g or request.endpoint == "metrics":
+            return response
+        endpoint = request.endpoint or "unmatched"
+        self.request_seconds.observe(endpoint, time.perf_counter() - g.metrics_started)
+        self.sql_queries.observe(endpoint, g.metrics_queries)
+        self.sql_seconds.observe(endpoint, g.metrics_sql_seconds)
+        self.render_seconds.observe(endpoint, g.metrics_render_seconds)
+        if not response.is_streamed and response.content_length is not None:
+            self.response_bytes.observe(endpoint, response.content_length)
+        if self.query_warn_threshold and g.metrics_queries > self.query_warn_threshold:
+            logger.warning("Possible N+1: %s %s ran %d SQL queries (%.1f ms in SQL)",
+                           request.method, request.path, g.metrics_queries, g.metrics_sql_seconds * 1000)
+        return response
+
+    def metrics_view(self):
+        if self.token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {self.token}"):
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        body = "\n".join(histogram.exposition() for histogram in self.histograms) + "\n"
+        return Response(body, mimetype="text/plain; version=0.0.4")
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,195 @@
+"""Schema migrations for databases created by earlier versions of the app.
+
+db.create_all() only creates missing tables, so every change to an existing
+table (a new column, a new index) is a numbered step in MIGRATIONS. The
+number of the last applied step is stored in the schema_version table; a
+fresh database is created from the models and stamped with the latest
+number. Steps check before they change anything, so re-running one is safe.
+"""
+from sqlalchemy import inspect, text
+
+from models import db, AnswerSelection, Form, Option, OptionCount, Question, Response
+from stats import backfill_answer_selections, rebuild_option_counts
+
+
+def add_column(table, column, ddl):
+    """Add a column unless the table already has it; returns whether it was added"""
+    columns = {c["name"] for c in inspect(db.engine).get_columns(table)}
+    if column in columns:
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{column}" {ddl}'))
+    return True
+
+
+def create_indexes(model):
+    """Create the indexes declared on a model that the database does not have yet"""
+    for index in model.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+
+def _add_form_version():
+    add_column("forms", "version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _add_access_path_indexes():
+    for model in (Form, Question, Option, Response, AnswerSelection, OptionCount):
+        create_indexes(model)
+
+
+def _add_dashboard_indexes():
+    create_indexes(Form)
+
+
+def _add_submission_policy():
+    add_column("forms", "submissionPolicy", "VARCHAR(16)")
+
+
+def _add_form_updated_at():
+    add_column("forms", "updatedAt", "VARCHAR")
+
+
+def _drop_title_index():
+    # Search is a substring match, which no (userId, title) index can serve beyond userId
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_forms_userId_title"))
+
+
+def _add_dashboard_id_indexes():
+    # The listing is ordered by (key, id); without id in the index SQLite sorts every page
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_forms_userId_createdAt"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_forms_userId_name"))
+    create_indexes(Form)
+
+
+def _drop_answer_index():
+    # Statistics read option_counts; nothing reads answers by (formId, questionId, answer)
+    # any more, and every free-text answer paid to keep the index up to date
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_responses_formId_questionId_answer"))
+
+
+def _add_question_position():
+    added = add_column("questions", "position", "INTEGER NOT NULL DEFAULT 0")
+    if added and db.engine.dialect.name == "sqlite":
+        # Questions were listed in insertion (rowid) order, and legacy ids are random
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE questions SET position = rowid"))
+
+
+def _backfill_option_counts():
+    # Statistics read option_counts only, so older responses must be counted before the page is served
+    backfill_answer_selections()
+    rebuild_option_counts()
+
+
+MIGRATIONS = [
+    (1, "Add forms.version for schema cache invalidation", _add_form_version),
+    (2, "Add indexes for the statistics, respond and dashboard queries", _add_access_path_indexes),
+    (3, "Add indexes for sorting the dashboard by name", _add_dashboard_indexes),
+    (4, "Add forms.submissionPolicy for duplicate submission checks", _add_submission_policy),
+    (5, "Add forms.updatedAt for Last-Modified on the respond page", _add_form_updated_at),
+    (6, "Backfill answer_selections and option_counts from existing responses", _backfill_option_counts),
+    (7, "Drop the unused (userId, title) index on forms", _drop_title_index),
+    (8, "Add id to the dashboard indexes so keyset pages need no sort", _add_dashboard_id_indexes),
+    (9, "Drop the unused (formId, questionId, answer) index on responses", _drop_answer_index),
+    (10, "Add questions.position so every page lists questions in builder order", _add_question_position),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table():
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+
+
+def current_version():
+    _ensure_version_table()
+    with db.engine.connect() as conn:
+        version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def _stamp(version):
+    _ensure_version_table()
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+
+def upgrade():
+    """Bring the database up to LATEST_VERSION, returning the steps applied"""
+    fresh = not inspect(db.engine).has_table(Form.__tablename__)
+    db.create_all()
+    if fresh:
+        _stamp(LATEST_VERSION)
+        return []
+
+    applied = []
+    version = current_version()
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        step()
+        _stamp(number)
+        applied.append((number, description))
+    return applied
+
+
+def hot_queries(form_id="x", user_id="x"):
+    """The queries behind the statistics, respond and dashboard pages, with the index each must use.
+
+    The dashboard and responses page entries come from the functions those
+    views call, with a cursor, so the checked SQL is the SQL that runs on a
+    deep page.
+    """
+    from index import forms_page_query
+    from stats import page_answers_query, responses_page_query
+    return {
+        "dashboard forms": (forms_page_query(user_id, 'newest', after=("x", "x")),
+                            "ix_forms_userId_createdAt_id"),
+        "dashboard oldest": (forms_page_query(user_id, 'oldest', after=("x", "x")),
+                             "ix_forms_userId_createdAt_id"),
+        "dashboard by name": (forms_page_query(user_id, 'name', after=("x", "x")),
+                              "ix_forms_userId_name_id"),
+        "dashboard search": (forms_page_query(user_id, 'newest', search="x", after=("x", "x")),
+                             "ix_forms_userId_createdAt_id"),
+        "form questions": (Question.query.filter_by(formId=form_id, saved=True),
+                           "ix_questions_formId_saved"),
+        "question options": (Option.query.filter(Option.questionId.in_([form_id])),
+                             "ix_options_questionId"),
+        "option counters": (OptionCount.query.filter_by(formId=form_id),
+                            "ix_option_counts_formId"),
+        "responses page": (responses_page_query(form_id, after=("x", "x")),
+                           "ix_responses_formId_createdAt_responderId"),
+        "responder answers": (page_answers_query([user_id, form_id]), "ix_responses_responderId"),
+    }
+
+
+def check_query_plans():
+    """Run EXPLAIN QUERY PLAN on the hot queries and report any that miss their index.
+
+    SQLite only. A query fails if it scans a table without an index, if it
+    sorts its rows in a temporary B-tree instead of reading them in index
+    order, or if it does not use the index it was designed for: a search on
+    another index may only match a prefix of the filter (e.g. formId alone)
+    and still read every row of the form. Returns a list of (name, plan detail); an empty list means
+    every query uses its index.
+    """
+    problems = []
+    if db.engine.dialect.name != "sqlite":
+        return problems
+    for name, (query, index) in hot_queries().items():
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+        with db.engine.connect() as conn:
+            plan = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql))]
+        for detail in plan:
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                problems.append((name, detail))
+            elif detail.startswith("USE TEMP B-TREE"):
+                problems.append((name, detail))
+        if not any(f"INDEX {index} " in f"{detail} " for detail in plan):
+            problems.append((name, f"does not use {index}: {'; '.join(plan)}"))
+    return problems
@@ -2,22 +2,102 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-import uuid
-import random
+from decouple import config
+import os
+import secrets
 import string
+import threading
+import time
+import uuid
+
+db = SQLAlchemy()  # Bound to the app by create_app() in app.py
+
+ID_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase  # ASCII order, so ids sort like their numbers
+
+def _base62(number, width):
+    digits = []
+    for _ in range(width):
+        number, remainder = divmod(number, 62)
+        digits.append(ID_ALPHABET[remainder])
+    return ''.join(reversed(digits))
+
+def generate_random_id(length=8):
+    """Generate a random alphanumeric ID (8 characters by default) from a secure source"""
+    return ''.join(secrets.choice(ID_ALPHABET) for _ in range(length))
+
+class SequentialIdGenerator:
+    """Time-ordered 15-character IDs that are unique without asking the database.
+
+    Each ID is the current time in milliseconds (7 chars), a node number (5 chars)
+    and a per-process sequence (3 chars). The node is the process id; with ID_NODE
+    set (multi-host deployments must do this) it is ID_NODE (0 to MAX_ID_NODE)
+    followed by the full process id, which Linux keeps below 2**22 (pid_max), so
+    two processes on a host never share a node. A forked child notices its new
+    process id and takes its own node, so workers forked from a preloaded app
+    never share one. IDs from one process are strictly increasing, so new rows
+    land at the end of the primary key index.
+    """
+
+    PID_BITS = 22
+    MAX_ID_NODE = 62 ** 5 // 2 ** PID_BITS - 1  # 217
 
-try:
-    from app import db
-except ImportError:
-    db = SQLAlchemy()
+    def __init__(self, node=None):
+        if node is not None and not 0 <= node <= self.MAX_ID_NODE:
+            raise ValueError(f"ID_NODE must be between 0 and {self.MAX_ID_NODE}, got {node}")
+        self.host_node = node
+        self._lock = threading.Lock()
+        self._reseed()
 
-def generate_random_id():
-    """Generate a random 8-character alphanumeric ID"""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    def _reseed(self):
+        self._pid = os.getpid()
+        if self.host_node is None:
+            node = self._pid
+        else:
+            node = self.host_node * 2 ** self.PID_BITS + self._pid % 2 ** self.PID_BITS
+        self.node = _base62(node, 5)
+        self._last_ms = 0
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reseed()  # Forked since the last id
+            now_ms = max(int(time.time() * 1000), self._last_ms)  # never step back with the clock
+            if now_ms == self._last_ms:
+                self._sequence += 1
+                if self._sequence >= 62 ** 3:
+                    # Sequence exhausted for this millisecond, borrow the next one
+                    now_ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return _base62(now_ms, 7) + self.node + _base62(self._sequence, 3)
+
+_id_node = config('ID_NODE', default='')
+generate_sequential_id = SequentialIdGenerator(int(_id_node) if _id_node else None)
+
+# ID strategy per table: short random ids where they show up in URLs (forms),
+# time-ordered ids everywhere else. Replace an entry to plug in another strategy.
+ID_GENERATORS = {
+    "users": generate_sequential_id,
+    "forms": generate_random_id,
+    "questions": generate_sequential_id,
+    "options": generate_sequential_id,
+    "responders": generate_sequential_id,
+    "responses": generate_sequential_id,
+}
+
+def new_id(table):
+    """Generate a primary key for a row of the given table"""
+    return ID_GENERATORS[table]()
+
+def id_default(table):
+    return lambda: new_id(table)
 
 class User(db.Model, UserMixin):
     __tablename__ = "users"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    id = db.Column(db.String(16), primary_key=True, default=id_default("users"))
     username = db.Column(db.String(50), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
 
@@ -35,15 +115,23 @@ class User(db.Model, UserMixin):
 
 class Form(db.Model):
     __tablename__ = "forms"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    __table_args__ = (
+        db.Index('ix_forms_userId_createdAt_id', 'userId', 'createdAt', 'id'),
+        db.Index('ix_forms_userId_name_id', 'userId', 'name', 'id'),
+    )
+    id = db.Column(db.String(8), primary_key=True, default=id_default("forms"))
     name = db.Column(db.String, default="")
     title = db.Column(db.String, default="")
     description = db.Column(db.String, default="")
     questionCount = db.Column(db.Integer, default=0)
     createdAt = db.Column(db.String, default=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     responsesCount = db.Column(db.Integer, default=0)
-    userId = db.Column(db.String(8), db.ForeignKey('users.id'))
-    questions = db.relationship('Question', backref='form', cascade="all, delete-orphan", lazy=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updatedAt = db.Column(db.String)  # Last builder save, "%Y-%m-%d %H:%M:%S"
+    submissionPolicy = db.Column(db.String(16))  # None means the DUPLICATE_POLICY setting
+    userId = db.Column(db.String(16), db.ForeignKey('users.id'))
+    questions = db.relationship('Question', backref='form', cascade="all, delete-orphan", lazy=True,
+                                order_by=lambda: (Question.position, Question.id))  # Builder order on every page
     options = db.relationship('Option', backref='form', cascade="all, delete-orphan", lazy=True)
     responses = db.relationship('Response', backref='form', cascade="all, delete-orphan", lazy=True)
 
@@ -55,17 +143,22 @@ class Form(db.Model):
             'questionCount': self.questionCount,
             'createdAt': self.createdAt,
             'responsesCount': self.responsesCount,
+            'submissionPolicy': self.submissionPolicy,
             'userId': self.userId
         }
 
 class Question(db.Model):
     __tablename__ = "questions"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    __table_args__ = (
+        db.Index('ix_questions_formId_saved', 'formId', 'saved'),
+    )
+    id = db.Column(db.String(16), primary_key=True, default=id_default("questions"))
     text = db.Column(db.String, default="")
     answerType = db.Column(db.String, default="")
     optionCount = db.Column(db.Integer, default=0)
     formId = db.Column(db.String(8), db.ForeignKey('forms.id'))
     saved = db.Column(db.Boolean, default=False)
+    position = db.Column(db.Integer, default=0, nullable=False)  # Place in the form, set by the builder
     options = db.relationship('Option', backref='question', cascade="all, delete-orphan", lazy=True)
     responses = db.relationship('Response', backref='question', cascade="all, delete-orphan", lazy=True)
 
@@ -81,10 +174,16 @@ class Question(db.Model):
 
 class Option(db.Model):
     __tablename__ = "options"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    __table_args__ = (
+        db.Index('ix_options_questionId', 'questionId'),
+        db.Index('ix_options_formId', 'formId'),
+    )
+    id = db.Column(db.String(16), primary_key=True, default=id_default("options"))
     text = db.Column(db.String, default="")
-    questionId = db.Column(db.String(8), db.ForeignKey('questions.id'))
+    questionId = db.Column(db.String(16), db.ForeignKey('questions.id'))
     formId = db.Column(db.String(8), db.ForeignKey('forms.id'))
+    selections = db.relationship('AnswerSelection', backref='option', cascade="all, delete-orphan", lazy=True)
+    counter = db.relationship('OptionCount', backref='option', cascade="all, delete-orphan", lazy=True, uselist=False)
 
     def toJson(self):
         return {
@@ -96,7 +195,7 @@ class Option(db.Model):
 
 class Responder(db.Model):
     __tablename__ = "responders"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    id = db.Column(db.String(16), primary_key=True, default=id_default("responders"))
     name = db.Column(db.String, nullable=False)
     responses = db.relationship('Response', backref='responder', cascade="all, delete-orphan", lazy=True)
 
@@ -108,12 +207,18 @@ class Responder(db.Model):
 
 class Response(db.Model):
     __tablename__ = "responses"
-    id = db.Column(db.String(8), primary_key=True, default=generate_random_id)
+    __table_args__ = (
+        db.Index('ix_responses_formId_createdAt_responderId', 'formId', 'createdAt', 'responderId'),
+        db.Index('ix_responses_questionId', 'questionId'),
+        db.Index('ix_responses_responderId', 'responderId'),
+    )
+    id = db.Column(db.String(16), primary_key=True, default=id_default("responses"))
     answer = db.Column(db.Text, default="")
     createdAt = db.Column(db.String, default=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    questionId = db.Column(db.String(8), db.ForeignKey('questions.id'))
+    questionId = db.Column(db.String(16), db.ForeignKey('questions.id'))
     formId = db.Column(db.String(8), db.ForeignKey('forms.id'))
-    responderId = db.Column(db.String(8), db.ForeignKey('responders.id'))
+    responderId = db.Column(db.String(16), db.ForeignKey('responders.id'))
+    selections = db.relationship('AnswerSelection', backref='response', cascade="all, delete-orphan", lazy=True)
 
     def toJson(self):
         return {
@@ -125,5 +230,52 @@ class Response(db.Model):
             'responderId': self.responderId
         }
 
+class AnswerSelection(db.Model):
+    """One selected option of a choice answer (radio, dropdown or checkbox)"""
+    __tablename__ = "answer_selections"
+    responseId = db.Column(db.String(16), db.ForeignKey('responses.id', ondelete="CASCADE"), primary_key=True)
+    optionId = db.Column(db.String(16), db.ForeignKey('options.id', ondelete="CASCADE"), primary_key=True, index=True)
+    questionId = db.Column(db.String(16), db.ForeignKey('questions.id', ondelete="CASCADE"), index=True)
+    formId = db.Column(db.String(8), db.ForeignKey('forms.id', ondelete="CASCADE"), index=True)
+
+    def toJson(self):
+        return {
+            'responseId': self.responseId,
+            'optionId': self.optionId,
+            'questionId': self.questionId,
+            'formId': self.formId
+        }
+
+class OptionCount(db.Model):
+    """Running number of responses that picked an option, kept up to date on submit"""
+    __tablename__ = "option_counts"
+    optionId = db.Column(db.String(16), db.ForeignKey('options.id', ondelete="CASCADE"), primary_key=True)
+    questionId = db.Column(db.String(16), db.ForeignKey('questions.id', ondelete="CASCADE"))
+    formId = db.Column(db.String(8), db.ForeignKey('forms.id', ondelete="CASCADE"), index=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    def toJson(self):
+        return {
+            'optionId': self.optionId,
+            'questionId': self.questionId,
+            'formId': self.formId,
+            'count': self.count
+        }
+
+class FormSubmitter(db.Model):
+    """Who already submitted a form: a browser token or a user id, per the form's policy"""
+    __tablename__ = "form_submitters"
+    formId = db.Column(db.String(8), db.ForeignKey('forms.id', ondelete="CASCADE"), primary_key=True)
+    submitterKey = db.Column(db.String(64), primary_key=True)
+    createdAt = db.Column(db.String, default=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def toJson(self):
+        return {
+            'formId': self.formId,
+            'submitterKey': self.submitterKey,
+            'createdAt': self.createdAt
+        }
+
 def init_db():
-    db.create_all()
+    from migrations import upgrade
+    upgrade()
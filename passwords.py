@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password checks are already waiting; the caller should ask the user to retry"""
+
+
+class PasswordHasher:
+    """Runs password hashing and checking on a small, bounded thread pool.
+
+    Hashing is deliberately slow, so a burst of logins handled on the request
+    threads would keep every thread of a worker busy. Here at most `workers`
+    hashes run at once and at most `max_pending` wait; beyond that a request
+    gets PasswordHasherBusy immediately instead of queueing behind the burst.
+    A request that waits longer than `timeout` also gets PasswordHasherBusy.
+    """
+
+    def __init__(self, workers=2, max_pending=32, timeout=10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", self.workers)
+        self.max_pending = app.config.get("PASSWORD_HASH_MAX_PENDING", self.max_pending)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.shutdown()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():  # Threads do not survive a fork
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._pool().submit(function, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the hash is done, not until the request stops
+        # waiting, so max_pending also counts hashes whose caller timed out
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # Drops it if it has not started yet
+            raise PasswordHasherBusy() from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -1,39 +1,59 @@
-from flask import Flask, flash, json, jsonify, redirect, render_template, request, session, url_for
+from flask import Flask, Response as HttpResponse, current_app, flash, json, jsonify, make_response, redirect, render_template, request, session, stream_with_context, url_for
 from datetime import datetime
 from flask_login import LoginManager, login_required, current_user
 from flask import Blueprint
 from flask_wtf.csrf import generate_csrf, validate_csrf
 from collections import defaultdict
+import csv
+import io
 
-from models import db,User,Form, Question, Option,Responder,Response, generate_random_id
+from models import db,User,Form, Question, Option,Responder,Response,AnswerSelection, new_id
+from schema_cache import form_schema_cache, get_current_form_schema, get_form_schema, load_form
+from stats import option_answer_counts, responses_page, iter_responder_answers
+from submissions import save_submission, group_commit_writer
+from ingest import submission_queue
+from sessions import mark_responded, responded_at
+from duplicates import AlreadySubmitted, duplicate_guard, POLICY_USER
+from fragments import render_questions
+from caching import cache_form_page, form_last_modified, form_page_etag, is_fresh
 
 respond_bp = Blueprint('respond', __name__)
 
+RESPONSES_PAGE_SIZE = 50
+MAX_RESPONSES_PAGE_SIZE = 500
+
 ''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 @respond_bp.route("/respond/<form_id>" ,methods = ["GET","POST"])
 def respond(form_id):
-    # form = db.execute("SELECT * FROM forms WHERE form_id = ?",form_id)[0]
-    form = Form.query.filter_by(id=form_id).first()
+    # Compiled schema, cached per form version; only loaded from the database on a miss.
+    # A submission is validated and written against the current version, which another
+    # worker may have changed since this one cached it.
+    form = get_form_schema(form_id) if request.method == "GET" else get_current_form_schema(form_id)
+    if not form:
+        return "Form not found", 404
     
-    # questions = db.execute("SELECT * FROM questions WHERE form_id = ?",form_id)
-    questions = Question.query.filter_by(formId=form_id).all()
+    questions = form.questions
+    options_map = form.options_map
     
-    # options=db.execute("SELECT * FROM options")
-    options = Option.query.all()
-
-
-    options = Option.query.all()
-    options_map = defaultdict(list)
-    for opt in options:
-        options_map[opt.questionId].append(opt)
+    # One response per browser or per user, depending on the form's policy
+    if duplicate_guard.policy(form) == POLICY_USER and not current_user.is_authenticated:
+        return current_app.login_manager.unauthorized()
+    submitter_key = duplicate_guard.submitter_key(form)
     
     if request.method=="GET":
-        # Check if user has already responded (if they have a session)
-        if session.get("responded_forms") and str(form_id) in session.get("responded_forms", []):
+        # Check if user has already responded
+        if duplicate_guard.has_submitted(form.id, submitter_key):
             return redirect(url_for('respond.response_submitted', form_id=form_id))
         
-        return render_template("respond.html" ,form=form, questions=questions, options_map=options_map)
+        # Same form version and session as the browser's copy: answer 304 without rendering
+        last_modified = form_last_modified(form)
+        if session.get("csrf_token") and is_fresh(form_page_etag(form), last_modified):
+            return cache_form_page(HttpResponse(status=304), form_page_etag(form), last_modified)
+        
+        # Question cards are rendered once per form version; only the page around them (CSRF token) per request
+        response = make_response(render_template("respond.html" ,form=form, questions_html=render_questions(form)))
+        return cache_form_page(response, form_page_etag(form), last_modified)  # The token may be new now
     else:
         # responder_name=request.form.get("name") 
         
@@ -42,48 +62,29 @@ def respond(form_id):
         
         
         # Check if user has already responded
-        if session.get("responded_forms") and str(form_id) in session.get("responded_forms", []):
+        if duplicate_guard.has_submitted(form.id, submitter_key):
             return redirect(url_for('respond.response_submitted', form_id=form_id))
         
-        # Create new responder with unique ID
-        responder_id = generate_random_id()
-        while Responder.query.get(responder_id):
-            responder_id = generate_random_id()
-            
-        responder_name = "resp_" + generate_random_id()
-        while Responder.query.filter_by(name=responder_name).first():
-            responder_name = "resp_" + generate_random_id()
-
-        new_responder = Responder(id=responder_id, name=responder_name)
-        db.session.add(new_responder)
-        db.session.flush()  # Flush to get the ID without committing
-        
-        # Set session responder_id immediately after creating responder
-        session["responder_id"] = new_responder.id
-        
-        # Validate all questions before processing
+        # Validate all questions before writing anything
+        answers_by_question = {}
         for question in questions:
             answers = None  # Initialize answers for each question
             
             if question.answerType != "text":
-                question_options = Option.query.filter_by(questionId=question.id).all()
-                option_list = [opt.text for opt in question_options]
+                option_list = question.option_texts
                 
                 if question.answerType == "radio":
                     answers = request.form.get(f"{question.id}")
                     if answers and answers not in option_list:
-                        db.session.rollback()  # Rollback if validation fails
                         return "One of the selected options is not in the options list"
                 elif question.answerType == "checkbox":
                     answers = request.form.getlist(f"{question.id}")
                     for answer in answers:
                         if answer not in option_list:
-                            db.session.rollback()  # Rollback if validation fails
                             return "One of the selected options is not in the options list"
                 elif question.answerType == "dropdown":
                     answers = request.form.get(f"{question.id}")
                     if answers and answers not in option_list:
-                        db.session.rollback()  # Rollback if validation fails
                         return "Selected option is not in the options list"
             else:
                 # For text questions
@@ -91,88 +92,68 @@ def respond(form_id):
             
             # Check if required question is empty
             if question.answerType != "checkbox" and (not answers or answers == ""):
-                db.session.rollback()  # Rollback if validation fails
-                return render_template("respond.html", form=form, questions=questions, options_map=options_map)
+                return render_template("respond.html", form=form, questions_html=render_questions(form))
             elif question.answerType == "checkbox" and (not answers or len(answers) == 0):
                 # For checkbox, it's optional, so we can continue
                 pass
+            answers_by_question[question.id] = answers
         
         date_time = datetime.now()
         date_time = date_time.strftime("%Y-%m-%d %H:%M:%S")
         
-        for question in questions:
-            if question.answerType != "checkbox":
-                answer = request.form.get(f"{question.id}")
-                
-                # Generate unique ID for new response
-                response_id = generate_random_id()
-                while Response.query.get(response_id):
-                    response_id = generate_random_id()
-                    
-                new_response = Response(
-                    id=response_id,
-                    answer=answer,
-                    createdAt=date_time,
-                    questionId=question.id,
-                    formId=form_id,
-                    responderId=session["responder_id"]
-                )
-                db.session.add(new_response)
-            else:
-                answers = request.form.getlist(f"{question.id}")
-                Answer = ""
-                for index, answer in enumerate(answers):
-                    Answer += f"{answer}"
-                    if index != (len(answers)-1):
-                        Answer += ", "
-                
-                response_id = generate_random_id()
-                while Response.query.get(response_id):
-                    response_id = generate_random_id()
-                    
-                new_response = Response(
-                    id=response_id,
-                    answer=Answer,
-                    createdAt=date_time,
-                    questionId=question.id,
-                    formId=form_id,
-                    responderId=session["responder_id"]
-                )
-                db.session.add(new_response)
-
-        form.responsesCount = (form.responsesCount or 0) + 1
-        
-        # Commit all changes at once
+        # Write the responder and all responses in one transaction (shared with
+        # concurrent requests under group commit), or queue them for the
+        # background writer when ingestion is asynchronous. The submitter is
+        # claimed with the write itself, so two concurrent submissions cannot
+        # both get through.
         try:
-            db.session.commit()
-        except Exception as e:
+            if submission_queue.enabled:
+                responder_id = new_id("responders")
+                submission_queue.enqueue(form.id, responder_id, date_time, answers_by_question, submitter_key)
+                session["responder_id"] = responder_id
+            elif group_commit_writer.enabled:
+                session["responder_id"] = group_commit_writer.submit(form, answers_by_question, date_time, submitter_key)
+            else:
+                session["responder_id"] = save_submission(form, answers_by_question, date_time, submitter_key=submitter_key)
+        except AlreadySubmitted:
+            duplicate_guard.remember(form.id, submitter_key)
+            return redirect(url_for('respond.response_submitted', form_id=form_id))
+        except Exception:
             db.session.rollback()
-            return f"Database error: {str(e)}"
-        
-        # Mark this form as responded to in the session
-        if "responded_forms" not in session:
-            session["responded_forms"] = []
-        session["responded_forms"].append(str(form_id))
+            current_app.logger.exception("Saving a response to form %s failed", form_id)
+            # The form may have changed under a stale schema; show the current one again
+            form_schema_cache.discard(form.id)
+            form = get_form_schema(form_id)
+            if not form:
+                return "Form not found", 404
+            flash('Your response could not be saved. Please check your answers and submit again.', 'danger')
+            return render_template("respond.html", form=form, questions_html=render_questions(form)), 409
+        if submitter_key is not None:
+            duplicate_guard.remember(form.id, submitter_key)
+        
+        # Mark this form as responded to in the session, with its submission time
+        mark_responded(form_id)
         session.permanent = True  # Make session persistent
         
-        # Store submission time
-        session[f"submission_time_{form_id}"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
         return redirect(url_for('respond.response_submitted', form_id=form_id))
 
 @respond_bp.route("/response-submitted/<form_id>")
 def response_submitted(form_id):
     """Display response submitted confirmation page"""
-    # Check if user actually submitted a response
-    if not session.get("responded_forms") or str(form_id) not in session.get("responded_forms", []):
-        # Redirect to form if no submission found
-        return redirect(url_for('respond.respond', form_id=form_id))
-    
-    form = Form.query.filter_by(id=form_id).first()
+    form = get_form_schema(form_id)
     if not form:
         return "Form not found", 404
     
-    submission_time = session.get(f"submission_time_{form_id}", "Unknown")
+    # Check if user actually submitted a response, from this session or
+    # (one per user) from another browser
+    submitted_at = responded_at(form_id)
+    if not submitted_at and not duplicate_guard.has_submitted(form.id, duplicate_guard.submitter_key(form)):
+        # Redirect to form if no submission found
+        return redirect(url_for('respond.respond', form_id=form_id))
+    
+    submission_time = "Unknown"
+    if submitted_at:
+        submission_time = datetime.fromtimestamp(submitted_at).strftime("%Y-%m-%d %H:%M:%S")
     
     return render_template("response_submitted.html", 
                          form=form, 
@@ -184,60 +165,83 @@ def response_submitted(form_id):
 @login_required
 def responses_statistics(form_id):
     if request.method == "GET":
-        form = Form.query.filter_by(id=form_id).first()
+        form = load_form(form_id)
+        if not form:
+            return "Form not found", 404
         
-        questions = Question.query.filter_by(formId=form_id).all()
+        questions = form.questions
         questionsJson = [q.toJson() for q in questions]
-        options = Option.query.all()
-        
-        # Fix the responses query to get proper objects
-        responses_query = db.session.query(Response, Responder).join(Responder, Response.responderId == Responder.id).filter(Response.formId == form_id).all()
         
-        # Convert to serializable format
-        responses = []
-        for response, responder in responses_query:
-            responses.append({
-                'id': response.id,
-                'answer': response.answer,
-                'createdAt': response.createdAt,
-                'questionId': response.questionId,
-                'formId': response.formId,
-                'responderId': response.responderId,
-                'responder_name': responder.name
-            })
-        
-        # Enhanced option_answer_count query to handle checkbox responses
-        option_answer_count = []
-        
-        for question in questions:
-            if question.answerType != "text":
-                question_options = Option.query.filter_by(questionId=question.id).all()
-                
-                for option in question_options:
-                    if question.answerType == "checkbox":
-                        # For checkbox, count occurrences of each option in comma-separated answers
-                        count = db.session.query(Response).filter(
-                            Response.questionId == question.id,
-                            Response.answer.like(f'%{option.text}%')
-                        ).count()
-                    else:
-                        # For radio and dropdown, exact match
-                        count = db.session.query(Response).filter(
-                            Response.questionId == question.id,
-                            Response.answer == option.text
-                        ).count()
-                    
-                    if count > 0:  # Only include options that have responses
-                        option_answer_count.append({
-                            'option': option.text,
-                            'count': count,
-                            'question_id': question.id
-                        })
+        # Per-option counts from the maintained counters
+        option_answer_count = option_answer_counts(form_id, questions)
         
         return render_template("responses.html", 
                              form=form,
                              questions=questionsJson,
-                             options=options,
-                             responses=responses,
                              option_answer_count=option_answer_count)
 
+
+@respond_bp.route("/responses_statistics/<form_id>/responses" ,methods = ["GET"])
+@login_required
+def responses_page_json(form_id):
+    """Page through a form's responses, one entry per responder"""
+    form = Form.query.filter_by(id=form_id, userId=current_user.id).first()
+    if not form:
+        return jsonify({'success': False, 'error': 'Form not found or unauthorized'}), 404
+
+    limit = min(request.args.get("limit", RESPONSES_PAGE_SIZE, type=int), MAX_RESPONSES_PAGE_SIZE)
+    after = None
+    if request.args.get("after_id"):
+        after = (request.args.get("after_created", ""), request.args.get("after_id"))
+
+    responders, next_cursor = responses_page(form_id, after=after, limit=max(limit, 1))
+    return jsonify({'success': True, 'responders': responders, 'next': next_cursor})
+
+
+@respond_bp.route("/responses_export/<form_id>" ,methods = ["GET"])
+@login_required
+def responses_export(form_id):
+    """Stream a form's responses as CSV (default) or NDJSON, one row per responder"""
+    export_format = request.args.get("format", "csv").lower()
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({'success': False, 'error': 'Format must be csv or ndjson'}), 400
+
+    form = Form.query.filter_by(id=form_id, userId=current_user.id).first()
+    if not form:
+        return jsonify({'success': False, 'error': 'Form not found or unauthorized'}), 404
+
+    # Same order as the respond and statistics pages (Form.questions)
+    questions = Question.query.filter_by(formId=form_id).order_by(Question.position, Question.id).all()
+    question_ids = [q.id for q in questions]
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["Name", "Date"] + [q.text for q in questions])
+        for name, created_at, answers in iter_responder_answers(form_id):
+            writer.writerow([name, created_at] + [answers.get(qid, "") for qid in question_ids])
+            # Flush in chunks rather than once per row
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_ndjson():
+        for name, created_at, answers in iter_responder_answers(form_id):
+            yield json.dumps({
+                'responder_name': name,
+                'createdAt': created_at,
+                'answers': {qid: answers.get(qid) for qid in question_ids}
+            }) + "\n"
+
+    if export_format == "csv":
+        body, mimetype = generate_csv(), "text/csv"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+
+    return HttpResponse(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{form_id}_responses.{export_format}"'}
+    )
@@ -0,0 +1,157 @@
+from collections import namedtuple
+
+from sqlalchemy.orm import selectinload
+
+from lru import LRUCache
+from models import db, Form, Question
+
+CompiledOption = namedtuple("CompiledOption", ["id", "text"])
+CompiledQuestion = namedtuple("CompiledQuestion", ["id", "text", "answerType", "options", "option_texts", "option_ids"])
+CompiledForm = namedtuple("CompiledForm", ["id", "name", "title", "description", "userId", "version", "updatedAt", "submissionPolicy", "questions", "options_map"])
+
+
+def load_form(form_id):
+    """Fetch a form with its questions and their options eagerly loaded"""
+    return Form.query.options(
+        selectinload(Form.questions).selectinload(Question.options)
+    ).filter_by(id=form_id).first()
+
+
+def compile_form(form):
+    """Turn a Form with loaded questions/options into an immutable schema.
+
+    option_texts is a frozenset for O(1) validation of submitted answers and
+    option_ids maps an option text to the first option id carrying it.
+    """
+    questions = []
+    options_map = {}
+    for question in form.questions:
+        options = tuple(CompiledOption(opt.id, opt.text) for opt in question.options)
+        option_ids = {}
+        for opt in options:
+            option_ids.setdefault(opt.text, opt.id)
+        questions.append(CompiledQuestion(
+            id=question.id,
+            text=question.text,
+            answerType=question.answerType,
+            options=options,
+            option_texts=frozenset(option_ids),
+            option_ids=option_ids
+        ))
+        options_map[question.id] = options
+    return CompiledForm(
+        id=form.id,
+        name=form.name,
+        title=form.title,
+        description=form.description,
+        userId=form.userId,
+        version=form.version or 0,
+        updatedAt=form.updatedAt or form.createdAt,
+        submissionPolicy=form.submissionPolicy,
+        questions=tuple(questions),
+        options_map=options_map
+    )
+
+
+class FormSchemaCache:
+    """In-process LRU cache of compiled form schemas.
+
+    Entries are keyed by form id and carry the form version they were compiled
+    from. Saves in this process invalidate immediately; other processes see a
+    save either through the optional shared backend (any cachelib-style object
+    with get/set/delete), which holds the current version of each form, or
+    once the local entry is older than `ttl` seconds.
+    """
+
+    def __init__(self, max_entries=512, ttl=30, backend=None):
+        self.backend = backend
+        self._entries = LRUCache(max_entries, ttl)
+
+    def init_app(self, app):
+        self._entries = LRUCache(
+            app.config.get("FORM_SCHEMA_CACHE_SIZE", self._entries.max_entries),
+            app.config.get("FORM_SCHEMA_CACHE_TTL", self._entries.ttl)
+        )
+        self.backend = app.config.get("FORM_SCHEMA_CACHE_BACKEND", self.backend)
+
+    def _shared_version(self, form_id):
+        if self.backend is None:
+            return None
+        return self.backend.get(f"form-version:{form_id}")
+
+    def get(self, form_id):
+        """Return the cached CompiledForm for form_id, or None on a miss"""
+        schema = self._entries.get(form_id)
+        if schema is None:
+            return None
+
+        shared_version = self._shared_version(form_id)
+        if shared_version is not None and shared_version != schema.version:
+            self.discard(form_id)
+            return None
+        return schema
+
+    def set(self, schema):
+        self._entries.set(schema.id, schema)
+
+    def discard(self, form_id):
+        self._entries.discard(form_id)
+
+    def invalidate(self, form_id, version=None):
+        """Drop a form after it was saved or deleted, publishing its new version if shared"""
+        self.discard(form_id)
+        if self.backend is not None:
+            if version is None:
+                self.backend.delete(f"form-version:{form_id}")
+            else:
+                self.backend.set(f"form-version:{form_id}", version, timeout=0)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+form_schema_cache = FormSchemaCache()
+
+
+def get_form_schema(form_id):
+    """Return the compiled schema of a form, loading and caching it on a miss"""
+    schema = form_schema_cache.get(form_id)
+    if schema is not None:
+        return schema
+
+    form = load_form(form_id)
+    if form is None:
+        return None
+    schema = compile_form(form)
+    form_schema_cache.set(schema)
+    return schema
+
+
+def get_current_form_schema(form_id):
+    """Like get_form_schema, but first checks the cached version against the database.
+
+    Other workers only see a builder save through the shared backend or the
+    TTL, so a write confirms the version with one primary key read and
+    reloads the schema if it changed.
+    """
+    schema = get_form_schema(form_id)
+    if schema is None:
+        return None
+    version = db.session.query(Form.version).filter_by(id=form_id).scalar()
+    if version is None:
+        form_schema_cache.discard(form_id)  # Deleted by another worker
+        return None
+    if version != schema.version:
+        form_schema_cache.discard(form_id)
+        schema = get_form_schema(form_id)
+    return schema
+
+
+def warm_form_schemas(limit):
+    """Compile the `limit` most answered forms into the cache; returns the schemas loaded"""
+    form_ids = [row.id for row in Form.query.with_entities(Form.id)
+                .order_by(Form.responsesCount.desc()).limit(limit)]
+    return [schema for schema in map(get_form_schema, form_ids) if schema is not None]
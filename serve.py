@@ -0,0 +1,90 @@
+"""Production server: gunicorn workers forked from one preloaded, warmed app.
+
+The master process builds the app, compiles the templates and loads the
+most answered forms into the schema and fragment caches, then forks the
+workers, so none of them starts cold. Settings come from decouple (HOST,
+PORT, SERVER_WORKERS, SERVER_THREADS, ...):
+
+    flask db-upgrade && python serve.py
+
+`kill -HUP <master pid>` rebuilds and rewarms the app in the master, starts
+new workers from it and lets the old ones finish their requests. To deploy
+new code without downtime, send USR2 (starts a new master on the new code),
+then QUIT to the old master.
+"""
+import logging
+import multiprocessing
+
+from decouple import config
+from gunicorn.app.base import BaseApplication
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import create_app
+from fragments import render_questions
+from models import db
+from schema_cache import warm_form_schemas
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def server_options():
+    return {
+        'bind': f"{config('HOST', default='0.0.0.0')}:{config('PORT', default=5000, cast=int)}",
+        'workers': config('SERVER_WORKERS', default=multiprocessing.cpu_count() * 2 + 1, cast=int),
+        'threads': config('SERVER_THREADS', default=4, cast=int),
+        'timeout': config('SERVER_TIMEOUT', default=30, cast=int),
+        'graceful_timeout': config('SERVER_GRACEFUL_TIMEOUT', default=30, cast=int),
+        'keepalive': config('SERVER_KEEPALIVE', default=5, cast=int),
+        'max_requests': config('SERVER_MAX_REQUESTS', default=0, cast=int),
+        'max_requests_jitter': config('SERVER_MAX_REQUESTS_JITTER', default=0, cast=int),
+        'accesslog': config('SERVER_ACCESS_LOG', default='-') or None,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }
+
+
+def warm_caches(app, forms):
+    """Fill the schema and respond fragment caches with the `forms` most answered forms"""
+    with app.app_context():
+        try:
+            schemas = warm_form_schemas(forms)
+            for schema in schemas:
+                render_questions(schema)
+            logger.info("Warmed the caches with %d forms", len(schemas))
+        except SQLAlchemyError as e:
+            # e.g. the schema does not exist yet; workers still start, with cold caches
+            logger.warning("Skipping cache warmup: %s", e)
+        finally:
+            db.session.remove()
+            db.engine.dispose()  # Workers must not inherit the master's database connections
+
+
+def post_fork(server, worker):
+    # Drop any pooled connection copied from the master without closing it under the master
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+
+class FormsServer(BaseApplication):
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        app = create_app()
+        warm_caches(app, config('SERVER_WARM_FORMS', default=100, cast=int))
+        return app
+
+    def reload(self):
+        # HUP: build a fresh app (and warm it) for the workers that replace the old ones
+        self.callable = None
+        super().reload()
+
+
+if __name__ == "__main__":
+    FormsServer(server_options()).run()
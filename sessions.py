@@ -0,0 +1,159 @@
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+import warnings
+
+from flask import current_app, session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+RESPONDED_KEY = "responded"
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Server-side sessions stored as rows of a small SQLite file.
+
+    The cookie only carries a random session id. A row is written when the
+    session changes, not on every request, and carries its expiry time, so
+    an expired session is ignored on read and removed by the occasional purge
+    that runs on about one write in `purge_every`.
+    """
+
+    def __init__(self, path, purge_every=500):
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._pid = None
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()  # Connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            self._create_table(conn)
+        return conn
+
+    def _create_table(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self._connect().execute(
+                "SELECT data FROM sessions WHERE sid = ? AND expires > ?", (sid, time.time())
+            ).fetchone()
+            if row is not None:
+                try:
+                    return SqliteSession(session_json_serializer.loads(row[0]), sid=sid)
+                except ValueError:
+                    pass
+        return SqliteSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        conn = self._connect()
+
+        if not session:
+            if session.modified and not session.new:
+                conn.execute("DELETE FROM sessions WHERE sid = ?", (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+                (session.sid, session_json_serializer.dumps(dict(session)), time.time() + app.permanent_session_lifetime.total_seconds())
+            )
+            if random.randrange(self.purge_every) == 0:
+                self.purge_expired()
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def purge_expired(self):
+        """Delete expired sessions; returns how many were removed"""
+        return self._connect().execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+
+
+def init_sessions(app):
+    """Install the session backend named by SESSION_BACKEND.
+
+    "sqlite" (default) keeps sessions in SESSION_DB_PATH; "cookie" uses Flask's
+    signed cookies, which are zlib-compressed when that is shorter and checked
+    against PERMANENT_SESSION_LIFETIME when read; any other value is passed to
+    Flask-Session as SESSION_TYPE (e.g. "redis").
+    """
+    backend = app.config.get("SESSION_BACKEND", "sqlite")
+    if backend == "sqlite":
+        path = app.config.get("SESSION_DB_PATH") or os.path.join(app.instance_path, "sessions.db")
+        app.session_interface = SqliteSessionInterface(path)  # The file is created on first use
+    elif backend == "cookie":
+        if app.config.get("SECRET_KEY") == "SECRET_KEY":
+            warnings.warn("SESSION_BACKEND=cookie with the default SECRET_KEY lets anyone forge a session; set SECRET_KEY")
+    else:
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = backend
+        Session(app)
+
+
+def _responded():
+    cutoff = int(time.time() - current_app.permanent_session_lifetime.total_seconds())
+    return {form_id: at for form_id, at in session.get(RESPONDED_KEY, {}).items() if at > cutoff}
+
+
+def mark_responded(form_id):
+    """Record a submission to form_id in the session.
+
+    The session keeps {form_id: unix time} for at most RESPONDED_FORMS_LIMIT
+    forms, dropping the oldest ones and any older than the session lifetime,
+    so it stays small however many forms the browser answers.
+    """
+    limit = current_app.config.get("RESPONDED_FORMS_LIMIT", 50)
+    responded = _responded()
+    responded[str(form_id)] = int(time.time())
+    if len(responded) > limit:
+        responded = dict(sorted(responded.items(), key=lambda item: item[1])[-limit:])
+    session[RESPONDED_KEY] = responded
+
+
+def responded_at(form_id):
+    """Unix time this session submitted form_id, or None"""
+    return _responded().get(str(form_id))
@@ -0,0 +1,294 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, insert, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, AnswerSelection, Option, OptionCount, Question, Responder, Response
+
+CHECKBOX_SEPARATOR = ", "
+
+
+def split_checkbox_answer(answer, option_texts):
+    """Split a stored checkbox answer back into the option texts it was built from.
+
+    Answers are saved as the selected options joined with ", ", so an option whose
+    own text contains ", " spans several pieces; those are re-joined greedily
+    against the known option texts of the question.
+    """
+    if not answer:
+        return []
+    parts = answer.split(CHECKBOX_SEPARATOR)
+    selected = []
+    i = 0
+    while i < len(parts):
+        # Prefer the longest run of pieces that forms a known option
+        for j in range(len(parts), i, -1):
+            candidate = CHECKBOX_SEPARATOR.join(parts[i:j])
+            if candidate in option_texts:
+                selected.append(candidate)
+                i = j
+                break
+        else:
+            i += 1
+    return selected
+
+
+def option_answer_counts(form_id, questions):
+    """Count answers per option for every choice question of a form.
+
+    Reads the form's option_counts rows (one per option, maintained on submit),
+    so the cost does not grow with the number of responses. Options are taken
+    from question.options, which callers should eager-load. Returns the list of {'option', 'count', 'question_id'}
+    dicts consumed by responses.html, in question/option order, skipping
+    options nobody picked.
+    """
+    choice_questions = [q for q in questions if q.answerType != "text"]
+    if not choice_questions:
+        return []
+
+    counts = dict(db.session.query(
+        OptionCount.optionId, OptionCount.count
+    ).filter(OptionCount.formId == form_id).all())
+
+    option_answer_count = []
+    for question in choice_questions:
+        for option in question.options:
+            count = counts.get(option.id, 0)
+            if count > 0:  # Only include options that have responses
+                option_answer_count.append({
+                    'option': option.text,
+                    'count': count,
+                    'question_id': question.id
+                })
+    return option_answer_count
+
+
+UPSERT_DIALECTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+def increment_option_counts(form_id, selections):
+    """Add one to the counter of each (question_id, option_id) in selections.
+
+    A pair may appear several times (a batch of submissions) and is then
+    added that many times. Meant to run in the same transaction as the
+    submitted responses, like Form.responsesCount. On SQLite and PostgreSQL
+    one INSERT ... ON CONFLICT DO UPDATE creates or bumps every counter, so
+    two transactions creating the same counter cannot both insert it; other
+    databases bump existing counters with one UPDATE per distinct increment
+    and create any missing ones.
+    """
+    increments = Counter(option_id for question_id, option_id in selections)
+    if not increments:
+        return
+    option_questions = dict((option_id, question_id) for question_id, option_id in selections)
+    rows = [
+        {'optionId': option_id, 'questionId': option_questions[option_id], 'formId': form_id, 'count': amount}
+        for option_id, amount in increments.items()
+    ]
+
+    upsert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        statement = upsert(OptionCount).values(rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[OptionCount.optionId],
+            set_={'count': OptionCount.count + statement.excluded['count']}
+        ))
+        return
+
+    by_amount = defaultdict(list)
+    for option_id, amount in increments.items():
+        by_amount[amount].append(option_id)
+
+    bumped = 0
+    for amount, option_ids in by_amount.items():
+        bumped += db.session.execute(
+            update(OptionCount).where(
+                OptionCount.optionId.in_(option_ids)
+            ).values(count=OptionCount.count + amount).execution_options(synchronize_session=False)
+        ).rowcount
+    if bumped == len(increments):
+        return
+
+    existing = {row[0] for row in db.session.query(OptionCount.optionId).filter(
+        OptionCount.optionId.in_(increments)
+    )}
+    db.session.bulk_insert_mappings(OptionCount, [row for row in rows if row['optionId'] not in existing])
+
+
+def rebuild_option_counts(form_id=None):
+    """Recompute option_counts from answer_selections, for one form or all of them.
+
+    Use it to reconcile the counters after a backfill or a manual data fix.
+    Returns the number of counter rows written.
+    """
+    stale = OptionCount.query
+    grouped = db.session.query(
+        AnswerSelection.optionId, AnswerSelection.questionId, AnswerSelection.formId, func.count()
+    ).join(
+        Option, Option.id == AnswerSelection.optionId
+    )
+    if form_id is not None:
+        stale = stale.filter(OptionCount.formId == form_id)
+        grouped = grouped.filter(AnswerSelection.formId == form_id)
+
+    stale.delete(synchronize_session=False)
+    grouped = grouped.group_by(
+        AnswerSelection.optionId, AnswerSelection.questionId, AnswerSelection.formId
+    )
+    written = db.session.execute(
+        insert(OptionCount).from_select(
+            ['optionId', 'questionId', 'formId', 'count'], grouped.statement
+        )
+    ).rowcount
+    db.session.commit()
+    return written
+
+
+def backfill_answer_selections(batch_size=1000):
+    """Populate answer_selections for choice responses saved before the table existed.
+
+    Walks the responses of choice questions in primary key order, a batch at a
+    time, parsing each stored answer back into option ids. Responses that
+    already have selections are skipped, so the backfill can be re-run safely.
+    Returns the number of selection rows written.
+    """
+    already_linked = db.session.query(AnswerSelection.responseId).filter(
+        AnswerSelection.responseId == Response.id
+    ).exists()
+    option_ids = {}
+    written = 0
+    last_id = ""
+
+    while True:
+        batch = db.session.query(
+            Response.id, Response.answer, Response.questionId, Response.formId, Question.answerType
+        ).join(
+            Question, Response.questionId == Question.id
+        ).filter(
+            Question.answerType != "text",
+            Response.id > last_id,
+            ~already_linked
+        ).order_by(Response.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        mappings = []
+        for response_id, answer, question_id, form_id, answer_type in batch:
+            if question_id not in option_ids:
+                option_ids[question_id] = {}
+                question_options = db.session.query(Option.id, Option.text).filter_by(questionId=question_id)
+                for option_id, text in question_options:
+                    option_ids[question_id].setdefault(text, option_id)
+            known = option_ids[question_id]
+            if answer_type == "checkbox":
+                texts = set(split_checkbox_answer(answer, known))
+            else:
+                texts = {answer} if answer in known else set()
+            for text in texts:
+                mappings.append({
+                    'responseId': response_id,
+                    'optionId': known[text],
+                    'questionId': question_id,
+                    'formId': form_id
+                })
+
+        if mappings:
+            db.session.bulk_insert_mappings(AnswerSelection, mappings)
+        db.session.commit()
+        written += len(mappings)
+        last_id = batch[-1][0]
+
+    return written
+
+
+def responses_page_query(form_id, after=None, limit=50):
+    """The (createdAt, responderId) rows of one responses page, plus one to tell whether more follow"""
+    page = db.session.query(
+        Response.createdAt, Response.responderId
+    ).filter(Response.formId == form_id)
+    if after:
+        # A row-value comparison is one range on the (formId, createdAt, responderId)
+        # index; the equivalent OR of two conditions is not
+        page = page.filter(tuple_(Response.createdAt, Response.responderId) > tuple_(*after))
+    return page.distinct().order_by(
+        Response.createdAt, Response.responderId
+    ).limit(limit + 1)
+
+
+def page_answers_query(responder_ids):
+    """Every answer of the given responders, with the responder name"""
+    # A responder belongs to one form, so the responder ids alone pick the rows;
+    # filtering on formId too would make SQLite walk the whole form's responses
+    return db.session.query(
+        Response.responderId, Response.questionId, Response.answer, Responder.name
+    ).join(
+        Responder, Response.responderId == Responder.id
+    ).filter(
+        Response.responderId.in_(responder_ids)
+    )
+
+
+def responses_page(form_id, after=None, limit=50):
+    """Return one page of a form's responses, grouped by responder.
+
+    Pages are keyed on (createdAt, responderId) rather than an offset, so
+    every page costs the same no matter how deep into the form it is. `after`
+    is the (createdAt, responderId) cursor returned with the previous page.
+    Returns (responders, next_cursor); next_cursor is None on the last page.
+    """
+    page = responses_page_query(form_id, after, limit).all()
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not page:
+        return [], None
+
+    responders = {}
+    for created_at, responder_id in page:
+        responders[responder_id] = {
+            'responderId': responder_id,
+            'responder_name': None,
+            'createdAt': created_at,
+            'answers': {}
+        }
+
+    rows = page_answers_query(list(responders)).all()
+    for responder_id, question_id, answer, name in rows:
+        responders[responder_id]['responder_name'] = name
+        responders[responder_id]['answers'][question_id] = answer
+
+    next_cursor = None
+    if has_more:
+        next_cursor = {'createdAt': page[-1][0], 'responderId': page[-1][1]}
+    return list(responders.values()), next_cursor
+
+
+def iter_responder_answers(form_id, batch_size=1000):
+    """Yield (responder_name, createdAt, {questionId: answer}) for every responder of a form.
+
+    Rows are streamed from a server-side cursor in batches of `batch_size` and
+    folded into one dict per responder as they arrive, so memory use does not
+    depend on how many responses the form has.
+    """
+    rows = db.session.query(
+        Response.responderId, Response.createdAt, Response.questionId, Response.answer, Responder.name
+    ).join(
+        Responder, Response.responderId == Responder.id
+    ).filter(
+        Response.formId == form_id
+    ).order_by(
+        Response.createdAt, Response.responderId
+    ).yield_per(batch_size)
+
+    current_id = None
+    current = None
+    for responder_id, created_at, question_id, answer, name in rows:
+        if responder_id != current_id:
+            if current is not None:
+                yield current
+            current_id = responder_id
+            current = (name, created_at, {})
+        current[2][question_id] = answer
+    if current is not None:
+        yield current
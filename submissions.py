@@ -0,0 +1,277 @@
+from collections import Counter
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import func, insert, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from duplicates import AlreadySubmitted
+from models import db, Form, FormSubmitter, Responder, Response, AnswerSelection, new_id
+from stats import increment_option_counts
+
+
+def build_submission_rows(form, answers_by_question, responder_id, created_at):
+    """Turn validated answers into row mappings for responses and answer_selections"""
+    responses = []
+    selections = []
+    for question in form.questions:
+        answers = answers_by_question.get(question.id)
+        if question.answerType == "checkbox":
+            answers = answers or []
+            answer = ", ".join(answers)
+        else:
+            answer = answers
+            answers = [answers] if question.answerType != "text" else []
+
+        response_id = new_id("responses")
+        responses.append({
+            'id': response_id,
+            'answer': answer,
+            'createdAt': created_at,
+            'questionId': question.id,
+            'formId': form.id,
+            'responderId': responder_id
+        })
+        for text in set(answers):
+            if text in question.option_ids:
+                selections.append({
+                    'responseId': response_id,
+                    'optionId': question.option_ids[text],
+                    'questionId': question.id,
+                    'formId': form.id
+                })
+    return responses, selections
+
+
+def claimed_submitters(pairs):
+    """The (form id, submitter key) pairs among pairs that already have a submission"""
+    if not pairs:
+        return set()
+    rows = db.session.query(FormSubmitter.formId, FormSubmitter.submitterKey).filter(
+        tuple_(FormSubmitter.formId, FormSubmitter.submitterKey).in_(list(pairs))
+    )
+    return {(row.formId, row.submitterKey) for row in rows}
+
+
+def write_submissions(submissions):
+    """Add any number of submissions to the current transaction with bulk statements.
+
+    Each submission is a (form schema, answers_by_question, responder_id,
+    created_at, submitter_key) tuple. A submission with a submitter key also
+    claims its form_submitters row here, so the duplicate check needs no
+    transaction of its own; one whose key was already claimed (earlier, or by
+    another submission of the batch) is left out. All responders, responses
+    and selections go out as one executemany each, and responsesCount and
+    option counters are bumped once per form. Nothing is committed here.
+
+    Returns the responder ids of the submissions left out as duplicates.
+    """
+    keys = {(form.id, key) for form, _, _, _, key in submissions if key is not None}
+    claimed = claimed_submitters(keys)
+    rejected = set()
+    submitters = []
+    responders = []
+    responses = []
+    selections = []
+    per_form = Counter()
+    selections_by_form = {}
+    for form, answers_by_question, responder_id, created_at, submitter_key in submissions:
+        if submitter_key is not None:
+            if (form.id, submitter_key) in claimed:
+                rejected.add(responder_id)
+                continue
+            claimed.add((form.id, submitter_key))
+            submitters.append({'formId': form.id, 'submitterKey': submitter_key, 'createdAt': created_at})
+        form_responses, form_selections = build_submission_rows(form, answers_by_question, responder_id, created_at)
+        responders.append({'id': responder_id, 'name': "resp_" + responder_id})
+        responses += form_responses
+        selections += form_selections
+        per_form[form.id] += 1
+        selections_by_form.setdefault(form.id, []).extend(
+            (row['questionId'], row['optionId']) for row in form_selections
+        )
+
+    if submitters:
+        db.session.execute(insert(FormSubmitter), submitters)
+    if responders:
+        db.session.execute(insert(Responder), responders)
+    if responses:
+        db.session.execute(insert(Response), responses)
+    if selections:
+        db.session.execute(insert(AnswerSelection), selections)
+    for form_id, count in per_form.items():
+        Form.query.filter_by(id=form_id).update(
+            {Form.responsesCount: func.coalesce(Form.responsesCount, 0) + count},
+            synchronize_session=False
+        )
+        increment_option_counts(form_id, selections_by_form[form_id])
+    return rejected
+
+
+def write_error(form_id, submitter_key, error):
+    """The error to report for a failed write of one submission, after a rollback.
+
+    An IntegrityError may be another process committing the same submitter
+    between our check and our insert; that is reported as AlreadySubmitted.
+    """
+    if isinstance(error, IntegrityError) and submitter_key is not None \
+            and claimed_submitters({(form_id, submitter_key)}):
+        return AlreadySubmitted()
+    return error
+
+
+def save_submission(form, answers_by_question, created_at, responder_id=None, submitter_key=None):
+    """Insert a responder and all of its responses with bulk statements and commit.
+
+    Ids come from the time-ordered generator, so nothing has to be read back
+    to check them. Returns the responder id; raises AlreadySubmitted if
+    submitter_key already has a submission for the form.
+    """
+    responder_id = responder_id or new_id("responders")
+    try:
+        rejected = write_submissions([(form, answers_by_question, responder_id, created_at, submitter_key)])
+        if not rejected:
+            db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        raise write_error(form.id, submitter_key, e)
+    if rejected:
+        db.session.rollback()
+        raise AlreadySubmitted()
+    return responder_id
+
+
+class PendingSubmission:
+    """A submission handed to the group-commit writer, with a signal for when it is durable.
+
+    It is either taken by the writer or cancelled by a request that gave up
+    waiting, never both, so a timed-out submission is never written later.
+    """
+
+    def __init__(self, submission):
+        self.submission = submission
+        self.done = threading.Event()
+        self.error = None
+        self.state = "queued"
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.state == "queued":
+                self.state = "taken"
+            return self.state == "taken"
+
+    def cancel(self):
+        with self._lock:
+            if self.state == "queued":
+                self.state = "cancelled"
+            return self.state == "cancelled"
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits submissions from concurrent requests together.
+
+    Request threads hand their submission over and block; the writer takes
+    whatever arrived within `window` seconds (up to `max_batch`), writes it in
+    one transaction and wakes every request once the commit returns. If a
+    batch fails, its submissions are retried one by one so a single bad
+    submission only fails its own request.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.window = 0.005
+        self.max_batch = 200
+        self.timeout = 30
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("GROUP_COMMIT_ENABLED", False)
+        self.window = app.config.get("GROUP_COMMIT_WINDOW_MS", self.window * 1000) / 1000
+        self.max_batch = app.config.get("GROUP_COMMIT_MAX_BATCH", self.max_batch)
+
+    def submit(self, form, answers_by_question, created_at, submitter_key=None):
+        """Queue a submission for the next group commit and wait until it is durable.
+
+        Returns the responder id, or raises the error that made the write fail
+        (AlreadySubmitted if submitter_key already has a submission).
+        """
+        self.start_worker()
+        # End the request's read transaction so its pooled connection is free for
+        # the writer; requests waiting here would otherwise hold the whole pool
+        db.session.commit()
+        responder_id = new_id("responders")
+        pending = PendingSubmission((form, answers_by_question, responder_id, created_at, submitter_key))
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            if pending.cancel():
+                raise TimeoutError("The submission was not written in time")
+            pending.done.wait()  # Already being written; its outcome is the one to report
+        if pending.error is not None:
+            raise pending.error
+        return responder_id
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        try:
+            rejected = write_submissions([pending.submission for pending in batch])
+            db.session.commit()
+            for pending in batch:
+                if pending.submission[2] in rejected:
+                    pending.error = AlreadySubmitted()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                form, _, _, _, submitter_key = batch[0].submission
+                batch[0].error = write_error(form.id, submitter_key, e)
+            else:
+                for pending in batch:
+                    self._commit([pending])
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [pending for pending in self._collect() if pending.take()]
+                if not batch:
+                    continue
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    for pending in batch:
+                        pending.error = pending.error or e
+                finally:
+                    db.session.remove()
+                    for pending in batch:
+                        pending.done.set()
+
+    def start_worker(self):
+        """Start this process's writer thread if it is not running (e.g. after a fork)"""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._worker.start()
+
+
+group_commit_writer = GroupCommitWriter()
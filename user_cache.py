@@ -0,0 +1,76 @@
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from lru import LRUCache
+from models import db, User
+
+
+class UserIdentity(UserMixin):
+    """What an authenticated request needs to know about its user, without the password hash"""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def toJson(self):
+        return {
+            'id': self.id,
+            'username': self.username
+        }
+
+
+class UserCache:
+    """In-process LRU cache of user identities, keyed by user id.
+
+    Entries expire after `ttl` seconds, which bounds how long another worker
+    process can keep serving a user that was changed or deleted elsewhere;
+    in this process any ORM update or delete of a User drops it at once.
+    """
+
+    def __init__(self, max_entries=4096, ttl=60):
+        self._entries = LRUCache(max_entries, ttl)
+
+    def init_app(self, app):
+        self._entries = LRUCache(
+            app.config.get("USER_CACHE_SIZE", self._entries.max_entries),
+            app.config.get("USER_CACHE_TTL", self._entries.ttl)
+        )
+
+    def get(self, user_id):
+        return self._entries.get(user_id)
+
+    def set(self, identity):
+        self._entries.set(identity.id, identity)
+
+    def invalidate(self, user_id):
+        self._entries.discard(user_id)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache()
+
+
+def load_identity(user_id):
+    """The UserIdentity of user_id from the cache, or from one narrow query on a miss"""
+    user_id = str(user_id)
+    identity = user_cache.get(user_id)
+    if identity is not None:
+        return identity
+
+    row = db.session.query(User.id, User.username).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    identity = UserIdentity(row.id, row.username)
+    user_cache.set(identity)
+    return identity
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _drop_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)